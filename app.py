@@ -1,394 +1,40 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
 import numpy as np
-from PIL import Image
-
-# Load the trained model
-model = tf.keras.models.load_model('plant_disease_detection_model.h5')
-
-# Define the classes and their corresponding information
-class_info = {
-    'Bell Pepper Bacterial Spot': {
-        'type': 'Bacterial disease',
-        'scientific_name': 'Xanthomonas campestris pv. vesicatoria',
-        'symptoms': [
-            'Water-soaked spots on leaves, stems, and fruit.',
-            'Spots may be dark brown or black with a yellow halo.',
-            'Lesions can coalesce, leading to wilting and death of affected tissue.',
-            'Fruit may develop raised, corky lesions with a rough texture.',
-            'Severely infected fruit may rot.'
-        ],
-        'causes': 'Bacterial spot in bell peppers is caused by the bacterium Xanthomonas campestris pv. vesicatoria. The bacteria can enter the plant through wounds, natural openings, or by splashing water.',
-        'treatment': [
-            'Remove and destroy infected plant material to reduce the source of bacteria.',
-            'Practice crop rotation to prevent the buildup of bacteria in the soil.',
-            'Avoid overhead irrigation to minimize water splashing and bacterial spread.',
-            'Use copper-based fungicides or bactericides as a preventive measure or early treatment.',
-            'Follow proper sanitation practices by disinfecting tools and equipment between uses.',
-            'Plant resistant or tolerant bell pepper varieties when available.'
-        ],
-        'prevention': [
-            'Plant disease-free or certified pathogen-free seeds or seedlings.',
-            'Maintain adequate spacing between plants to promote air circulation and drying of foliage.',
-            'Avoid working in wet conditions or handling plants when they are wet.',
-            'Keep the garden free of weeds and debris, as they can harbor the bacteria.',
-            'Monitor plants regularly for early signs of infection and take immediate action.'
-        ]
-    },
-    'Bell Pepper Healthy': {},
-    'Corn Common Rust': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Puccinia sorghi',
-        'symptoms': [
-            'Orange or reddish-brown pustules or lesions on leaves, husks, and other above-ground plant parts',
-            'Pustules may rupture and release powdery spores',
-            'Yellowing and drying of infected leaves',
-            'Reduced plant growth and yield'
-        ],
-        'causes': 'Fungal infection by Puccinia sorghi',
-        'treatment': [
-            'Plant resistant corn varieties when available',
-            'Fungicide application can be considered in severe cases, following label instructions',
-            'Remove and destroy infected plant material to reduce the source of spores',
-            'Crop rotation with non-host plants can help break the disease cycle'
-        ],
-        'prevention': [
-            'Plant corn varieties with resistance to common rust',
-            'Ensure proper spacing between plants for good air circulation',
-            'Avoid excessive nitrogen fertilization, as it can promote disease development',
-            'Avoid working in wet conditions or handling plants when they are wet',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Corn Gray Leaf Spot': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Cercospora zeae-maydis',
-        'symptoms': [
-            'Small, rectangular lesions with gray centers and dark borders on leaves',
-            'Lesions may expand and merge, causing extensive damage',
-            'Yellowing and drying of infected leaves',
-            'Premature defoliation'
-        ],
-        'causes': 'Fungal infection by Cercospora zeae-maydis',
-        'treatment': [
-            'Plant corn hybrids with genetic resistance to gray leaf spot',
-            'Fungicide application can be considered in severe cases, following label instructions',
-            'Crop rotation with non-host plants can help reduce disease pressure',
-            'Remove and destroy infected plant material to reduce the source of inoculum'
-        ],
-        'prevention': [
-            'Ensure proper plant spacing for good air circulation',
-            'Avoid excessive nitrogen fertilization, as it can promote disease development',
-            'Practice field sanitation by removing crop debris after harvest',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Corn Healthy': {},
-    'Corn Northern Leaf Blight': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Setosphaeria turcica',
-        'symptoms': [
-            'Long, elliptical lesions with tan or grayish color on leaves',
-            'Lesions may have dark borders and extend along the length of the leaf',
-            'Severe infections can cause extensive leaf damage and defoliation',
-            'Reduced plant growth and yield'
-        ],
-        'causes': 'Fungal infection by Setosphaeria turcica',
-        'treatment': [
-            'Plant corn hybrids with genetic resistance to northern leaf blight',
-            'Fungicide application can be considered in severe cases, following label instructions',
-            'Crop rotation with non-host plants can help break the disease cycle',
-            'Remove and destroy infected plant material to reduce the source of spores'
-        ],
-        'prevention': [
-            'Ensure proper plant spacing for good air circulation',
-            'Avoid excessive nitrogen fertilization, as it can promote disease development',
-            'Practice field sanitation by removing crop debris after harvest',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Potato Early Blight': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Alternaria solani',
-        'symptoms': [
-            'Circular to irregular-shaped brown lesions on leaves, starting from lower leaves and progressing upward',
-            'Lesions may have concentric rings or dark margins',
-            'Yellowing and wilting of infected leaves',
-            'Premature defoliation'
-        ],
-        'causes': 'Fungal infection by Alternaria solani',
-        'treatment': [
-            'Plant potato cultivars with resistance to early blight',
-            'Fungicide application can be considered in severe cases, following label instructions',
-            'Ensure proper spacing between plants for good air circulation',
-            'Practice field sanitation by removing infected plant debris'
-        ],
-        'prevention': [
-            'Rotate potato crops with non-host plants for at least two years',
-            'Avoid overhead irrigation to minimize leaf wetness',
-            'Plant certified disease-free potato seed tubers',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Potato Healthy': {},
-    'Potato Late Blight': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Phytophthora infestans',
-        'symptoms': [
-            'Water-soaked lesions on leaves, stems, and tubers',
-            'Lesions rapidly enlarge and turn dark brown to purplish-black',
-            'White, fuzzy growth may appear on the underside of leaves under humid conditions',
-            'Foul odor from rotting tubers'
-        ],
-        'causes': 'Fungal infection by Phytophthora infestans',
-        'treatment': [
-            'Plant potato cultivars with resistance to late blight',
-            'Fungicide application is often necessary, following label instructions and appropriate timing',
-            'Remove and destroy infected plant material immediately to reduce the source of spores',
-            'Properly dispose of infected tubers to prevent overwintering of the pathogen'
-        ],
-        'prevention': [
-            'Plant certified disease-free potato seed tubers',
-            'Ensure proper spacing between plants for good air circulation',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness',
-            'Monitor plants regularly for early signs of infection and take immediate action',
-            'Practice field sanitation by removing crop debris after harvest'
-        ]
-    },
-    'Tomato Bacterial Spot': {
-        'type': 'Bacterial disease',
-        'scientific_name': 'Xanthomonas vesicatoria',
-        'symptoms': [
-            'Water-soaked spots on leaves, stems, and fruit',
-            'Spots may be dark brown to black with a yellow halo',
-            'Lesions can coalesce, leading to wilting and death of affected tissue',
-            'Fruit may develop raised, corky lesions with a rough texture'
-        ],
-        'causes': 'Bacterial infection by Xanthomonas vesicatoria',
-        'treatment': [
-            'Plant tomato varieties with resistance to bacterial spot, if available',
-            'Apply copper-based bactericides as a preventive measure or early treatment',
-            'Remove and destroy infected plant material to reduce the source of bacteria',
-            'Practice crop rotation to prevent the buildup of bacteria in the soil'
-        ],
-        'prevention': [
-            'Use certified disease-free tomato seeds or seedlings',
-            'Ensure proper plant spacing for good air circulation',
-            'Avoid overhead irrigation to minimize water splashing and bacterial spread',
-            'Practice field sanitation by removing crop debris after harvest',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Tomato Early Blight': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Alternaria solani',
-        'symptoms': [
-            'Circular to irregular-shaped brown lesions on leaves',
-            'Lesions may have concentric rings or dark margins',
-            'Lower leaves are usually affected first',
-            'Yellowing and wilting of infected leaves'
-        ],
-        'causes': 'Fungal infection by Alternaria solani',
-        'treatment': [
-            'Remove and destroy infected plant material to reduce the source of spores',
-            'Apply fungicides according to label instructions and appropriate timing',
-            'Ensure proper plant spacing for good air circulation',
-            'Practice crop rotation with non-host plants to break the disease cycle'
-        ],
-        'prevention': [
-            'Plant disease-resistant tomato varieties, if available',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness',  
-            'Apply mulch to reduce soil splash onto the lower leaves',
-            'Practice field sanitation by removing crop debris after harvest',
-            'Monitor plants regularly for early signs of infection and take immediate action'   
-        ]
-    },
-    'Tomato Healthy': {},
-    'Tomato Late Blight': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Phytophthora infestans',
-        'symptoms': [
-            'Dark, water-soaked lesions on leaves, stems, and fruit',
-            'Lesions rapidly enlarge and turn brown to black',
-            'White, fuzzy growth may appear on the underside of leaves under humid conditions',
-            'Fruit rot and decay with a foul odor'
-        ],
-        'causes': 'Fungal infection by Phytophthora infestans',
-        'treatment': [
-            'Remove and destroy infected plant material immediately to reduce the spread of spores',
-            'Apply fungicides according to label instructions and appropriate timing',
-            'Maintain good airflow by pruning and staking tomato plants',
-            'Ensure proper plant spacing for good air circulation'
-        ],
-        'prevention': [
-            'Plant disease-resistant tomato varieties, if available',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness',
-            'Apply mulch to reduce soil splash onto the lower leaves',
-            'Practice crop rotation with non-host plants to break the disease cycle',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Tomato Leaf Mold': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Passalora fulva (formerly known as Fulvia fulva)',
-        'symptoms': [
-            'Pale yellow or light green areas on upper leaf surfaces',
-            'Velvety olive-green to brown patches on lower leaf surfaces',
-            'Affected leaves may curl and become distorted',
-            'Yellowing and wilting of infected leaves'
-        ],
-        'causes': 'Fungal infection by Passalora fulva',
-        'treatment': [
-            'Remove and destroy infected plant material to reduce the source of spores',
-            'Ensure good air circulation by proper plant spacing and pruning',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness',
-            'Apply fungicides according to label instructions and appropriate timing'
-        ],
-        'prevention': [
-            'Plant disease-resistant tomato varieties, if available',
-            'Avoid overcrowding and provide proper plant spacing for good air circulation',
-            'Promote healthy plant growth through balanced fertilization and watering practices',
-            'Apply mulch to reduce soil splash onto the lower leaves',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Tomato Septoria Leaf Spot': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Septoria lycopersici',
-        'symptoms': [
-            'Numerous small, circular spots with dark brown centers and yellow halos on lower leaves',
-            'Spots may coalesce and cause leaves to turn yellow and drop prematurely',
-            'Leaves may have a "shot-hole" appearance with tiny holes in the center of spots',
-            'Fruit is usually not affected by the disease'
-        ],
-        'causes': 'Fungal infection by Septoria lycopersici',
-        'treatment': [
-            'Remove and destroy infected plant material to reduce the source of spores',
-            'Ensure proper plant spacing for good air circulation',
-            'Apply fungicides according to label instructions and appropriate timing',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness'
-        ],
-        'prevention': [
-            'Plant disease-resistant tomato varieties, if available',
-            'Avoid overcrowding and provide proper plant spacing for good air circulation',
-            'Promote healthy plant growth through balanced fertilization and watering practices',
-            'Apply mulch to reduce soil splash onto the lower leaves',
-            'Practice crop rotation with non-host plants to break the disease cycle'
-        ]
-    },
-    'Tomato Spider Mites': {
-        'type': 'Pest infestation',
-        'scientific_name': 'Tetranychus urticae (commonly known as Two-Spotted Spider Mite)',
-        'symptoms': [
-            'Fine webbing on the undersides of leaves',
-            'Tiny yellow or white speckles on leaves',
-            'Leaves may turn yellow, dry out, or become stippled',
-            'Severe infestations can cause defoliation and reduced plant vigor'
-        ],
-        'causes': 'Infestation by Tetranychus urticae (Two-Spotted Spider Mite)',
-        'treatment': [
-            'Spray affected plants with a strong stream of water to dislodge and control mites',
-            'Introduce predatory mites or beneficial insects to help control the population',
-            'Use insecticidal soap, neem oil, or horticultural oils as a natural control method',
-            'Consider applying acaricides if infestation is severe and other methods are ineffective'
-        ],
-        'prevention': [
-            'Maintain proper plant hygiene and remove weeds or debris that can harbor mites',
-            'Avoid over-fertilization, as it can promote mite populations',
-            'Monitor plants regularly for early signs of infestation and take immediate action',
-            'Provide adequate plant nutrition and avoid water stress to promote plant vigor'
-        ]
-    },
-    'Tomato Target Spot': {
-        'type': 'Fungal disease',
-        'scientific_name': 'Corynespora cassiicola',
-        'symptoms': [
-            'Circular to irregular-shaped lesions on leaves, stems, and fruit',
-            'Lesions have concentric rings and a target-like appearance',
-            'Lesions may start as small, dark spots and enlarge over time',
-            'Affected tissue may turn brown or black and become necrotic'
-        ],
-        'causes': 'Fungal infection by Corynespora cassiicola',
-        'treatment': [
-            'Remove and destroy infected plant material to reduce the source of spores',
-            'Ensure proper plant spacing for good air circulation',
-            'Apply fungicides according to label instructions and appropriate timing',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness'
-        ],
-        'prevention': [
-            'Plant disease-resistant tomato varieties, if available',
-            'Avoid overhead irrigation and water plants at the base to minimize leaf wetness',
-            'Apply mulch to reduce soil splash onto the lower leaves',
-            'Practice crop rotation with non-host plants to break the disease cycle',
-            'Monitor plants regularly for early signs of infection and take immediate action'
-        ]
-    },
-    'Tomato Mosaic Virus': {
-        'type': 'Viral disease',
-        'scientific_name': 'Tomato mosaic virus (ToMV)',
-        'symptoms': [
-            'Mottled or streaked yellowing on leaves',
-            'Leaf distortion and curling',
-            'Reduced plant growth and stunted development',
-            'Fruit may show mosaic patterns or exhibit color distortions'
-        ],
-        'causes': 'Infection by Tomato mosaic virus (ToMV)',
-        'treatment': [
-            'There is no cure for viral infections, so prevention is key',
-            'Plant resistant tomato varieties, if available',
-            'Control aphids and other insect vectors that can transmit the virus',
-            'Remove and destroy infected plants to prevent further spread'
-        ],
-        'prevention': [
-            'Use disease-free seeds or certified virus-free transplants',
-            'Sanitize tools and equipment to prevent virus transmission',
-            'Manage weed populations that can serve as virus reservoirs',
-            'Control insect vectors through appropriate insecticide applications',
-            'Avoid working in the garden when hands are contaminated with tobacco or other infected plants'
-        ]
-    },
-    'Tomato Yellow Leaf Curl Virus': {
-        'type': 'Viral disease',
-        'scientific_name': 'Tomato yellow leaf curl virus (TYLCV)',
-        'symptoms': [
-            'Yellowing and upward curling of leaves, particularly young leaves',
-            'Leaf narrowing and reduced leaf size',
-            'Stunted plant growth and reduced vigor',
-            'Abnormal development of flowers and fruits'
-        ],
-        'causes': 'Infection by Tomato yellow leaf curl virus (TYLCV)',
-        'treatment': [
-            'There is no cure for viral infections, so prevention is crucial',
-            'Plant resistant tomato varieties, specifically bred for TYLCV resistance',
-            'Control whiteflies and other insect vectors that transmit the virus',
-            'Remove and destroy infected plants to prevent further spread'
-        ],
-        'prevention': [
-            'Use disease-free seeds or certified virus-free transplants',
-            'Use physical barriers such as insect netting to exclude whiteflies',
-            'Implement cultural practices to minimize whitefly populations, such as removing weed hosts',
-            'Practice good weed and pest management to reduce the presence of alternative hosts',
-            'Avoid working in the garden when hands are contaminated with virus-infected plants'
-        ]
-    }
-}
 
-# Define the class labels
-class_labels = [
-    'Bell Pepper Bacterial Spot', 'Bell Pepper Healthy', 'Corn Common Rust',
-    'Corn Gray Leaf Spot', 'Corn Healthy', 'Corn Northern Leaf Blight',
-    'Potato Early Blight', 'Potato Healthy', 'Potato Late Blight',
-    'Tomato Bacterial Spot', 'Tomato Early Blight', 'Tomato Healthy',
-    'Tomato Late Blight', 'Tomato Leaf Mold', 'Tomato Septoria Leaf Spot',
-    'Tomato Spider Mites', 'Tomato Target Spot', 'Tomato Mosaic Virus',
-    'Tomato Yellow Leaf Curl Virus'
-]
-healthy_labels = [
-    'Bell Pepper Healthy', 'Corn Healthy', 'Potato Healthy', 'Tomato Healthy'
-]
-plant_labels=["Bell Pepper","Corn","Potato","Tomato"]
+import head_trainer
+import metrics
+import model_registry
+import prediction_cache
+import prefilter
+import video_stream
+from corrections import CorrectionStore
+from tiling import MIN_TILE_FRACTION, TILE_SIZE, TILE_STRIDE, open_full_resolution, predict_tiled, render_overlay
+from inference import (class_labels, plant_labels, BATCH_SIZE,
+                       DECODE_WORKERS, iter_batches, predict_batch, prepare_image,
+                       top_prediction)
+
+# Load the trained model once per process, shared across sessions and reruns
+@st.cache_resource(show_spinner="Loading model...")
+def load_model():
+    return model_registry.get_model()
 
+@st.cache_resource
+def correction_store():
+    return CorrectionStore()
+
+# Load the pre-filter cascade that rejects non-leaf and unsupported images
+@st.cache_resource
+def load_cascade():
+    return prefilter.load_cascade()
+
+# Serve Prometheus metrics from this process on PLANT_METRICS_PORT
+@st.cache_resource
+def start_metrics_server():
+    return metrics.start_http_server()
 
 # Define colors for styling
 colors = {
@@ -429,67 +75,318 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Define the function to preprocess the input image
-def preprocess_image(img):
-    img = img.resize((256, 256))
-    img = image.img_to_array(img)
-    img = np.expand_dims(img, axis=0)
-    img = img / 255.0  # Normalize the image
-    return img
+# Decode, preprocess and score the raw bytes of an uploaded image
+def predict_image(data):
+    img = prepare_image(data)
+    model = load_model()
+    predictions = predict_batch(model, [img], 1)[0]
+    model_registry.record_prediction()
+    return predictions
 
-# Streamlit app code
-def main():
-    st.write("**Note:** Only supported plants are:", ", ".join(plant_labels))
-    st.title("Plant Disease Detection")
+# Cache key for an image under the weights currently being served
+def prediction_key(data):
+    load_model()
+    return f"{model_registry.model_version}-{prediction_cache.content_hash(data)}"
+
+# Look up predictions for the upload, so reruns and repeat uploads skip inference
+def cached_predictions(data):
+    key = prediction_key(data)
+    cached = st.session_state.get('last_prediction')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    predictions = prediction_cache.default_cache.get_or_compute(key, lambda: predict_image(data))
+    st.session_state['last_prediction'] = (key, predictions)
+    return predictions
+
+# Uploads the user chose to analyze despite a pre-filter rejection
+def is_overridden(data):
+    return prediction_cache.content_hash(data) in st.session_state.get('prefilter_overrides', set())
+
+# Run the pre-filter on an upload unless it is switched off or the user chose to analyze it anyway
+def screen_image(data):
+    if not st.session_state.get('prefilter', prefilter.PREFILTER):
+        return None
+    if is_overridden(data):
+        return None
+    digest = prediction_cache.content_hash(data)
+    cached = st.session_state.get('last_prefilter')
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    decision = load_cascade().check(prepare_image(data))
+    st.session_state['last_prefilter'] = (digest, decision)
+    return decision
 
+# Explain a rejection and offer to run the full model regardless
+def show_rejection(data, reason, key='analyzeAnyway'):
+    st.warning(f"This image was not analyzed: {reason}. "
+               f"Only leaves of supported plants can be diagnosed: {', '.join(plant_labels)}.")
+    st.image(data, use_column_width=True)
+    if st.button("Analyze anyway", key=key):
+        st.session_state.setdefault('prefilter_overrides', set()).add(prediction_cache.content_hash(data))
+        st.rerun()
+
+# Display additional information for the predicted class as one prerendered block
+def show_class_info(predicted_class):
+    from class_info import rendered
+    with metrics.timed('render_class_info'):
+        st.markdown(rendered[predicted_class])
+
+# Store a correction and retrain the classifier head on all corrections so far
+def record_correction(data, predicted_class, correct_class):
+    store = correction_store()
+    store.add(prediction_cache.content_hash(data), prepare_image(data), predicted_class, correct_class)
+    if model_registry.BACKEND != 'keras':
+        st.info("Correction saved. Fine-tuning needs the Keras backend; run head_trainer.py to retrain.")
+        return
+    try:
+        with st.spinner("Fine-tuning the classifier head..."):
+            weights = head_trainer.train_head(load_model(), store)
+    except head_trainer.MissingAnchors:
+        # Fitting the shared head to corrections alone would make it forget the other classes
+        st.warning("Correction saved, but the model was not updated: the anchor training set is not available. "
+                   "Set PLANT_ANCHOR_DIR or ship the cached anchor embeddings from the corrections directory.")
+        return
+    model_registry.update_head(weights)
+    st.success("Model updated successfully!")
+
+# Score a single uploaded image
+def single_image_mode():
     # Drag and drop functionality for image upload
     uploaded_file = st.file_uploader("Drag and drop an image here", type=["jpg", "jpeg", "png"], accept_multiple_files=False, key='fileUploader')
 
     if uploaded_file is not None:
-        # Preprocess the uploaded image
-        img = image.load_img(uploaded_file)
-        img = preprocess_image(img)
-
-        # Make predictions
-        predictions = model.predict(img)
+        # Make predictions, reusing cached results for an image already scored
+        data = uploaded_file.getvalue()
+        decision = screen_image(data)
+        if decision is not None and not decision.accepted:
+            show_rejection(data, decision.reason)
+            return
+        predictions = cached_predictions(data)
         predicted_class = class_labels[np.argmax(predictions)]
         confidence = np.max(predictions)
 
-        # Display predicted class and percentage damaged
-        st.subheader("Predicted Class:")
-        st.write(predicted_class)
-        st.subheader("Confidence Level:")
-        st.write(f"{confidence * 100:.2f}%")
-
-        # Display the uploaded image with styling
-        st.subheader("Uploaded Image:")
-        st.image(img, use_column_width=True)
-    
-        # Display additional information for the predicted class
-        if predicted_class not in healthy_labels:
-            st.subheader("Type:")
-            st.write(class_info[predicted_class]['type'])
-            st.subheader("Scientific Name:")
-            st.write(class_info[predicted_class]['scientific_name'])
-            st.subheader("Symptoms:")
-            for symptom in class_info[predicted_class]['symptoms']:
-                st.write(f"- {symptom}")
-            st.subheader("Cause:")
-            st.write(class_info[predicted_class]['causes'])
-            st.subheader("Treatment and Control:")
-            for treatment in class_info[predicted_class]['treatment']:
-                st.write(f"- {treatment}")
-            st.subheader("Prevention:")
-            for prevention in class_info[predicted_class]['prevention']:
-                st.write(f"- {prevention}")
+        with metrics.timed('render'):
+            # Display predicted class and percentage damaged
+            st.subheader("Predicted Class:")
+            st.write(predicted_class)
+            st.subheader("Confidence Level:")
+            st.write(f"{confidence * 100:.2f}%")
+            if decision is not None and decision.plant and not predicted_class.startswith(decision.plant):
+                st.caption(f"The pre-filter saw a {decision.plant} leaf; check the prediction.")
+
+            # Display the uploaded image with styling
+            st.subheader("Uploaded Image:")
+            st.image(data, use_column_width=True)
+
+            show_class_info(predicted_class)
 
         # Allow users to correct the prediction
         st.subheader("Correct Prediction")
         correct_class = st.selectbox("Select the correct class", class_labels, index=class_labels.index(predicted_class))
         if st.button("Update Model") and correct_class != predicted_class:
-            # Update the model with the corrected information
-            class_info[correct_class] = class_info[predicted_class]
-            st.success("Model updated successfully!")
+            record_correction(data, predicted_class, correct_class)
+
+# Score several uploaded images in fixed-size batches, rendering results as each batch finishes
+def multi_image_mode():
+    uploaded_files = st.file_uploader("Drag and drop images here", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key='multiFileUploader')
+    if not uploaded_files:
+        return
+
+    files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    keys = [prediction_key(data) for _, data in files]
+
+    # Keep only results for the current uploads, then fill in from the process-wide cache
+    previous = st.session_state.get('batch_predictions', {})
+    results = {key: previous[key] for key in keys if key in previous}
+    use_prefilter = st.session_state.get('prefilter', prefilter.PREFILTER)
+    previous_rejected = st.session_state.get('batch_rejected', {}) if use_prefilter else {}
+    rejected = {key: previous_rejected[key] for key, (_, data) in zip(keys, files)
+                if key in previous_rejected and not is_overridden(data)}
+    pending = {}
+    for key, (_, data) in zip(keys, files):
+        if key in results or key in rejected or key in pending:
+            continue
+        cached = prediction_cache.default_cache.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            pending[key] = data
+
+    def summary_rows():
+        rows = []
+        for key, (name, _) in zip(keys, files):
+            if key in results:
+                predicted_class, confidence = top_prediction(results[key])
+                rows.append({'Image': name, 'Predicted Class': predicted_class,
+                             'Confidence': f"{confidence * 100:.2f}%"})
+            elif key in rejected:
+                rows.append({'Image': name, 'Predicted Class': "Not analyzed", 'Confidence': rejected[key]})
+        return rows
+
+    st.subheader("Results:")
+    table = st.empty()
+    table.dataframe(summary_rows(), use_container_width=True)
+
+    if pending:
+        model = load_model()
+        cascade = load_cascade() if use_prefilter else None
+        progress = st.progress(0.0, text=f"Scoring {len(pending)} images...")
+        batches = list(iter_batches(list(pending.items()), BATCH_SIZE))
+        with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+            # Decode the next batch while the current one runs through the model
+            futures = [pool.submit(prepare_image, data) for _, data in batches[0]]
+            for n, batch in enumerate(batches):
+                images = [future.result() for future in futures]
+                if n + 1 < len(batches):
+                    futures = [pool.submit(prepare_image, data) for _, data in batches[n + 1]]
+                # Only images that pass the pre-filter go through the full model
+                accepted = list(range(len(batch)))
+                if cascade is not None:
+                    decisions = cascade.check_batch(images)
+                    accepted = [i for i, decision in enumerate(decisions)
+                                if decision.accepted or is_overridden(batch[i][1])]
+                    for i, decision in enumerate(decisions):
+                        if i not in accepted:
+                            rejected[batch[i][0]] = decision.reason
+                if accepted:
+                    predictions = predict_batch(model, [images[i] for i in accepted], BATCH_SIZE)
+                    model_registry.record_prediction()
+                    for i, prediction in zip(accepted, predictions):
+                        results[batch[i][0]] = prediction
+                        prediction_cache.default_cache.put(batch[i][0], prediction)
+                progress.progress((n + 1) / len(batches), text=f"Scored {min((n + 1) * BATCH_SIZE, len(pending))} of {len(pending)} images")
+                with metrics.timed('render_table'):
+                    table.dataframe(summary_rows(), use_container_width=True)
+        progress.empty()
+    st.session_state['batch_predictions'] = results
+    st.session_state['batch_rejected'] = rejected
+
+    # Show the detailed view for one image on demand
+    selected = st.selectbox("Show details for", range(len(files)), format_func=lambda i: files[i][0])
+    name, data = files[selected]
+    if keys[selected] in rejected:
+        st.subheader(name)
+        show_rejection(data, rejected[keys[selected]], key=f"analyzeAnyway-{keys[selected]}")
+        return
+    predicted_class, confidence = top_prediction(results[keys[selected]])
+    with metrics.timed('render'):
+        st.subheader(f"{name}: {predicted_class} ({confidence * 100:.2f}%)")
+        st.image(data, use_column_width=True)
+        show_class_info(predicted_class)
+
+# Score a high-resolution image as overlapping tiles and show a disease heatmap
+def tiled_mode():
+    uploaded_file = st.file_uploader("Drag and drop a high-resolution image here", type=["jpg", "jpeg", "png"], accept_multiple_files=False, key='tiledFileUploader')
+    tile = st.sidebar.number_input("Tile size", min_value=64, max_value=2048, value=TILE_SIZE, step=32)
+    # Strides up to the tile size keep the tiles overlapping (or at least touching)
+    stride = st.sidebar.number_input("Tile stride", min_value=32, max_value=int(tile), value=min(TILE_STRIDE, int(tile)), step=32)
+    min_fraction = st.sidebar.slider("Min. share of diseased tiles", min_value=0.0, max_value=0.5, value=MIN_TILE_FRACTION, step=0.01)
+    if uploaded_file is None:
+        return
+
+    data = uploaded_file.getvalue()
+    key = f"{prediction_key(data)}-{tile}-{stride}"
+    cached = st.session_state.get('last_tiled')
+    if cached is not None and cached[0] == key:
+        _, result, overlay = cached
+    else:
+        with st.spinner("Scoring tiles..."):
+            img = open_full_resolution(data)
+            result = predict_tiled(load_model(), img, tile, stride, BATCH_SIZE, min_fraction)
+            overlay = render_overlay(img, result.heatmap)
+        model_registry.record_prediction()
+        st.session_state['last_tiled'] = (key, result, overlay)
+
+    predicted_class, confidence, supporting = result.verdict(min_fraction)
+    with metrics.timed('render'):
+        st.subheader("Predicted Class:")
+        st.write(predicted_class)
+        st.subheader("Confidence Level:")
+        st.write(f"{confidence * 100:.2f}% (confident on {supporting} of {result.tiles} tiles)")
+        st.caption(f"{result.tiles} tiles in {result.seconds:.2f}s ({result.tiles_per_second:.1f} tiles/sec)")
+        st.subheader("Disease Heatmap:")
+        st.image(overlay, use_column_width=True)
+        show_class_info(predicted_class)
+
+# Score a field video as a frame stream and show the timeline of detected diseases
+def video_mode():
+    if not video_stream.video_supported():
+        st.error("Video analysis needs OpenCV on the server: pip install opencv-python-headless")
+        return
+    uploaded_file = st.file_uploader("Drag and drop a video here", type=[ext[1:] for ext in video_stream.VIDEO_EXTENSIONS], accept_multiple_files=False, key='videoFileUploader')
+    if uploaded_file is None:
+        return
+
+    data = uploaded_file.getvalue()
+    key = prediction_key(data)
+    cached = st.session_state.get('last_video')
+    if cached is not None and cached[0] == key:
+        result = cached[1]
+    else:
+        status = st.empty()
+        # OpenCV reads from a file, so spool the upload to disk for the duration of the run
+        suffix = os.path.splitext(uploaded_file.name)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+            f.write(data)
+            f.flush()
+            cascade = load_cascade() if st.session_state.get('prefilter', prefilter.PREFILTER) else None
+            result = video_stream.stream(video_stream.iter_video_frames(f.name), load_model(), BATCH_SIZE,
+                                         cascade=cascade, on_progress=lambda stats: status.text(str(stats)))
+        status.empty()
+        model_registry.record_prediction()
+        st.session_state['last_video'] = (key, result)
+
+    stats = result['stats']
+    with metrics.timed('render'):
+        st.subheader("Timeline:")
+        st.dataframe([{'From': f"{s['start']:.1f}s", 'To': f"{s['end']:.1f}s", 'Detected': s['label'],
+                       'Confidence': f"{s['confidence'] * 100:.1f}%"} for s in result['segments']],
+                     use_container_width=True)
+        st.caption(f"{stats['frames']} frames: {stats['scored']} scored, {stats['skipped']} skipped as near-duplicates, "
+                   f"{stats['rejected']} without a supported leaf; {stats['realtime_factor']:.2f}x realtime")
+        st.line_chart({'confidence': [frame['confidence'] for frame in result['frames']]})
+        detected = [s['label'] for s in result['segments'] if s['label'] in class_labels]
+        if detected:
+            choice = st.selectbox("Show details for", sorted(set(detected)))
+            show_class_info(choice)
+
+# Streamlit app code
+def main():
+    start_metrics_server()
+    st.write("**Note:** Only supported plants are:", ", ".join(plant_labels))
+    st.title("Plant Disease Detection")
+
+    mode = st.sidebar.radio("Mode", ["Single image", "Multiple images", "High-resolution (tiled)", "Video"])
+    st.sidebar.checkbox("Reject non-leaf images", value=prefilter.PREFILTER, key='prefilter')
+    if mode == "Single image":
+        single_image_mode()
+    elif mode == "Multiple images":
+        multi_image_mode()
+    elif mode == "High-resolution (tiled)":
+        tiled_mode()
+    else:
+        video_mode()
+
+    # Report startup time and time to first prediction
+    if model_registry.timings:
+        st.sidebar.subheader("Startup")
+        for name in ('tf_import_s', 'model_load_s', 'warmup_s', 'startup_s', 'first_prediction_s'):
+            if name in model_registry.timings:
+                st.sidebar.write(f"{name}: {model_registry.timings[name]:.2f}s")
+
+    # Report prediction cache effectiveness
+    stats = prediction_cache.default_cache.stats()
+    st.sidebar.subheader("Prediction Cache")
+    st.sidebar.write(f"Hits: {stats['hits']} (disk: {stats['disk_hits']}), misses: {stats['misses']}, "
+                     f"hit rate: {stats['hit_rate'] * 100:.1f}%")
+
+    # Optional debug panel with per-stage latency and the prediction distribution
+    if st.sidebar.checkbox("Show metrics"):
+        st.sidebar.subheader("Stage Latency")
+        st.sidebar.dataframe([{'stage': stage, **{k: round(v, 2) for k, v in summary.items()}}
+                              for stage, summary in sorted(metrics.stage_summary().items())])
+        st.sidebar.subheader("Predicted Classes")
+        st.sidebar.bar_chart(metrics.class_distribution())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+import os
+import threading
+
+import numpy as np
+
+# Inference backends share the predict_on_batch interface of a Keras model, so
+# the app, batch tools and server can use any of them interchangeably.
+BACKENDS = ('keras', 'tflite', 'onnx')
+NUM_THREADS = int(os.environ.get('PLANT_NUM_THREADS', '0')) or None
+
+
+class KerasBackend:
+
+    def __init__(self, path):
+        import model_registry
+        self.model = model_registry.load_model(path, 'keras')
+
+    def predict_on_batch(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    # A TFLite Interpreter is not thread-safe and reallocates its tensors when the
+    # input is resized. Streamlit sessions and server workers share one backend,
+    # so keep one interpreter per (padded) batch size, each behind its own lock.
+
+    def __init__(self, path, num_threads=NUM_THREADS):
+        # Prefer the small tflite_runtime package, fall back to full TensorFlow
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.path = path
+        self.num_threads = num_threads
+        self._interpreter_class = Interpreter
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.input = interpreter.get_input_details()[0]
+        self.output = interpreter.get_output_details()[0]
+
+    def _interpreter(self, batch_size):
+        with self._lock:
+            if batch_size not in self._interpreters:
+                interpreter = self._interpreter_class(model_path=self.path, num_threads=self.num_threads)
+                shape = [batch_size] + list(self.input['shape'][1:])
+                interpreter.resize_tensor_input(self.input['index'], shape)
+                interpreter.allocate_tensors()
+                self._interpreters[batch_size] = (interpreter, threading.Lock())
+            return self._interpreters[batch_size]
+
+    def predict_on_batch(self, batch):
+        interpreter, lock = self._interpreter(len(batch))
+        dtype = self.input['dtype']
+        if dtype != np.float32:
+            # Quantize the normalized input for integer-only models
+            scale, zero_point = self.input['quantization']
+            batch = np.round(batch / scale + zero_point)
+            info = np.iinfo(dtype)
+            batch = np.clip(batch, info.min, info.max).astype(dtype)
+        with lock:
+            interpreter.set_tensor(self.input['index'], batch)
+            interpreter.invoke()
+            predictions = interpreter.get_tensor(self.output['index'])
+        if self.output['dtype'] != np.float32:
+            scale, zero_point = self.output['quantization']
+            predictions = (predictions.astype(np.float32) - zero_point) * scale
+        return predictions
+
+
+class OnnxBackend:
+
+    def __init__(self, path, num_threads=NUM_THREADS):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict_on_batch(self, batch):
+        return self.session.run(None, {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+def load_backend(name, path, num_threads=NUM_THREADS):
+    if name == 'keras':
+        return KerasBackend(path)
+    if name == 'tflite':
+        return TFLiteBackend(path, num_threads)
+    if name == 'onnx':
+        return OnnxBackend(path, num_threads)
+    raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
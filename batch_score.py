@@ -0,0 +1,213 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+import model_registry
+from backends import BACKENDS
+from dataset import IMAGE_EXTENSIONS
+from inference import BATCH_SIZE, DECODE_WORKERS, class_labels, predict_batch, prepare_image
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ['path', 'predicted_class', 'confidence', 'top_k']
+
+
+# Stream image paths from directory trees, single files and file lists, in a stable order
+def iter_image_paths(inputs, file_list=None):
+    for source in inputs:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield source
+    if file_list:
+        with open(file_list) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def output_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+# Cut an output file back to its last complete line. An interrupted run can
+# leave half a row behind, which would otherwise either pass for a finished
+# image or stay in the file next to the rescored one.
+def truncate_partial_line(path, chunk_size=65536):
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(chunk_size, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position < end:
+            logger.warning("Removing %d bytes of a partially written line from %s", end - position, path)
+            f.truncate(position)
+
+
+# Collect the paths already present in an output file so an interrupted run can
+# resume; a partially written last line is removed first
+def read_completed(path):
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    truncate_partial_line(path)
+    with open(path, newline='') as f:
+        if output_format(path) == 'csv':
+            for row in csv.DictReader(f):
+                # A row cut off by an interrupted run is missing its later fields
+                if all(row.get(field) for field in CSV_FIELDS):
+                    completed.add(row['path'])
+        else:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    continue
+    return completed
+
+
+class ResultWriter:
+    # Append results to a CSV or JSONL file, flushing after every batch
+
+    def __init__(self, path):
+        self.format = output_format(path)
+        # read_completed has already cut the file back to its last complete line
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'a', newline='')
+        if self.format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if not exists:
+                self.writer.writeheader()
+
+    def write(self, path, predictions, top_k):
+        indices = np.argsort(predictions)[::-1][:top_k]
+        top = [(class_labels[i], float(predictions[i])) for i in indices]
+        if self.format == 'csv':
+            self.writer.writerow({
+                'path': path,
+                'predicted_class': top[0][0],
+                'confidence': f"{top[0][1]:.6f}",
+                'top_k': ';'.join(f"{label}:{confidence:.6f}" for label, confidence in top),
+            })
+        else:
+            self.file.write(json.dumps({
+                'path': path,
+                'predicted_class': top[0][0],
+                'confidence': top[0][1],
+                'top_k': [{'label': label, 'confidence': confidence} for label, confidence in top],
+            }) + '\n')
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def _safe_prepare(path):
+    try:
+        return prepare_image(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Skipping %s: %s", path, e)
+        return None
+
+
+# Group paths into batches and decode them ahead of the model, keeping at most
+# `prefetch` batches in flight so memory stays bounded for any dataset size
+def prefetch_batches(paths, pool, batch_size=BATCH_SIZE, prefetch=2):
+    in_flight = deque()
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            in_flight.append((batch, [pool.submit(_safe_prepare, p) for p in batch]))
+            batch = []
+            if len(in_flight) > prefetch:
+                yield _collect(*in_flight.popleft())
+    if batch:
+        in_flight.append((batch, [pool.submit(_safe_prepare, p) for p in batch]))
+    while in_flight:
+        yield _collect(*in_flight.popleft())
+
+
+def _collect(batch, futures):
+    images = [future.result() for future in futures]
+    return [(p, img) for p, img in zip(batch, images) if img is not None]
+
+
+def score(paths, output, model, batch_size=BATCH_SIZE, top_k=3, workers=DECODE_WORKERS, prefetch=2):
+    completed = read_completed(output)
+    if completed:
+        logger.info("Resuming: %d images already scored in %s", len(completed), output)
+    paths = (p for p in paths if p not in completed)
+
+    writer = ResultWriter(output)
+    scored = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in prefetch_batches(paths, pool, batch_size, prefetch):
+                if not batch:
+                    continue
+                predictions = predict_batch(model, [img for _, img in batch], batch_size)
+                with metrics.timed('write'):
+                    for (path, _), prediction in zip(batch, predictions):
+                        writer.write(path, prediction, top_k)
+                    writer.flush()
+                scored += len(batch)
+                logger.info("Scored %d images", scored)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    return scored, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a directory tree of plant images without the Streamlit UI.")
+    parser.add_argument('inputs', nargs='*', help="Image directories or files")
+    parser.add_argument('--file-list', help="Text file with one image path per line")
+    parser.add_argument('-o', '--output', required=True, help="Output file (.csv or .jsonl); appended to and resumed if it exists")
+    parser.add_argument('--model', help="Model path (defaults to the model registry's choice)")
+    parser.add_argument('--backend', choices=BACKENDS, default=model_registry.BACKEND)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS, help="Decode threads")
+    parser.add_argument('--prefetch', type=int, default=2, help="Batches decoded ahead of the model")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.file_list:
+        parser.error("give at least one input directory/file or --file-list")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    model = model_registry.load_model(args.model, args.backend)
+    paths = iter_image_paths(args.inputs, args.file_list)
+    scored, elapsed = score(paths, args.output, model, args.batch_size, args.top_k, args.workers, args.prefetch)
+    rate = scored / elapsed if elapsed else 0.0
+    print(f"Scored {scored} images in {elapsed:.1f}s ({rate:.1f} images/sec)")
+    for stage, summary in sorted(metrics.stage_summary().items()):
+        print(f"  {stage:<10} {summary['count']:>8} calls, mean {summary['mean_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import argparse
+import io
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+from PIL import Image
+
+# Define the synthetic photo sizes: a 12 megapixel phone photo and a typical upload
+IMAGE_SIZES = {'12mp': (4000, 3000), '2mp': (1600, 1200)}
+
+
+# Build a JPEG with smooth structure plus noise, so it compresses like a photo
+def synthetic_jpeg(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# The original app path: full-resolution decode, PIL resize, float copy, divide
+def baseline(data):
+    from inference import preprocess_image
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    return preprocess_image(img)
+
+
+# The served path (app, server, batch_score): reduced-size JPEG decode to a
+# fresh uint8 array, normalized into predict_batch's reused float32 buffer
+def served(data):
+    from inference import prepare_image
+    from preprocessing import IMAGE_SIZE, batch_input_buffer, normalize
+    batch = batch_input_buffer((1,) + IMAGE_SIZE[::-1] + (3,))
+    normalize(prepare_image(data), batch[0])
+    return batch
+
+
+# The parallel_score path: decode straight into a preallocated shared-memory slot
+_slot = None
+
+
+def slot(data):
+    global _slot
+    from inference import prepare_image
+    from preprocessing import IMAGE_SIZE
+    if _slot is None:
+        _slot = np.empty(IMAGE_SIZE[::-1] + (3,), dtype=np.uint8)
+    return prepare_image(data, _slot)
+
+
+METHODS = {'baseline': baseline, 'served': served, 'slot': slot}
+
+
+def _measure(method, data, runs, queue):
+    # Runs in a fresh process so the peak RSS belongs to this method only
+    function = METHODS[method]
+    function(data)
+    start = time.perf_counter()
+    for _ in range(runs):
+        function(data)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed / runs * 1000, after / 1024))
+
+
+def measure(method, data, runs):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(method, data, runs, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-image preprocessing time and peak memory.")
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(f"{'image':<8}{'method':<10}{'ms/image':>10}{'peak RSS MB':>14}")
+    for name, (width, height) in IMAGE_SIZES.items():
+        data = synthetic_jpeg(width, height)
+        for method in METHODS:
+            ms, peak_mb = measure(method, data, args.runs)
+            print(f"{name:<8}{method:<10}{ms:>10.2f}{peak_mb:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from queue import Empty
+
+import numpy as np
+
+BATCH_SIZES = (1, 8, 32, 64)
+# Synthetic photo sizes: a 12 megapixel phone photo and a typical web upload
+IMAGE_SIZES = {'12mp': (4000, 3000), '2mp': (1600, 1200)}
+# Seconds one backend/thread configuration may take before it is abandoned
+BACKEND_TIMEOUT = 1800
+
+
+def default_models():
+    import model_registry
+    from export_models import FP16_PATH, INT8_PATH, ONNX_PATH
+    models = {
+        'keras': ('keras', model_registry.resolve_model_path()),
+        # What the app and server actually serve: traced, warmed up and XLA-compiled per PLANT_XLA
+        'keras_compiled': ('keras_compiled', model_registry.resolve_model_path()),
+        'tflite_fp16': ('tflite', FP16_PATH),
+        'tflite_int8': ('tflite', INT8_PATH),
+        'onnx': ('onnx', ONNX_PATH),
+    }
+    return {name: spec for name, spec in models.items() if os.path.exists(spec[1])}
+
+
+def summarize(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        'mean_ms': float(np.mean(samples)),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'runs': int(len(samples)),
+    }
+
+
+def time_it(function, repeat, warmup=2):
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+# Stages that do not depend on the model: full decode, the original
+# preprocess_image path and the fast decode path
+def bench_preprocessing(images, repeat):
+    from PIL import Image
+    from bench_preprocess import baseline
+    from inference import prepare_image
+    results = {}
+    for name, data in images.items():
+        results[f'decode/{name}'] = time_it(lambda: Image.open(io.BytesIO(data)).convert('RGB'), repeat)
+        results[f'preprocess_image/{name}'] = time_it(lambda: baseline(data), repeat)
+        results[f'prepare_image/{name}'] = time_it(lambda: prepare_image(data), repeat)
+    return results
+
+
+def _bench_backend(backend, path, threads, images, repeat, batch_sizes, queue):
+    # Runs in a fresh process so thread settings and model load time are not
+    # affected by earlier configurations
+    try:
+        if backend in ('keras', 'keras_compiled') and threads:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        from backends import load_backend
+        from inference import predict_batch, prepare_image
+
+        start = time.perf_counter()
+        if backend == 'keras':
+            model = load_backend(backend, path)
+        elif backend == 'keras_compiled':
+            model = load_backend('keras', path)
+        else:
+            model = load_backend(backend, path, threads or None)
+        results = {'model_load': summarize([time.perf_counter() - start])}
+        if backend == 'keras_compiled':
+            from inference_engine import compile_model
+            start = time.perf_counter()
+            model = compile_model(model.model, (1,) + tuple(batch_sizes))
+            results['warmup'] = summarize([time.perf_counter() - start])
+
+        image = prepare_image(next(iter(images.values())))
+        for batch_size in batch_sizes:
+            batch = [image] * batch_size
+            stats = time_it(lambda: predict_batch(model, batch, batch_size), max(3, repeat // batch_size))
+            stats['images_per_sec'] = batch_size * 1000 / stats['mean_ms']
+            results[f'forward/batch_{batch_size}'] = stats
+
+        for name, data in images.items():
+            results[f'end_to_end/{name}'] = time_it(lambda: predict_batch(model, [prepare_image(data)], 1), repeat)
+        queue.put(results)
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def bench_backend(backend, path, threads, images, repeat, batch_sizes, timeout=BACKEND_TIMEOUT):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_bench_backend,
+                              args=(backend, path, threads, images, repeat, batch_sizes, queue))
+    process.start()
+    # A child killed by a segfault or the OOM killer never puts a result
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                results = queue.get(timeout=1)
+                break
+            except Empty:
+                if process.exitcode is not None:
+                    return {'error': f"benchmark process exited with code {process.exitcode}"}
+                if time.monotonic() > deadline:
+                    return {'error': f"benchmark process timed out after {timeout}s"}
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+    return results
+
+
+def run(models, thread_counts, repeat, batch_sizes=BATCH_SIZES):
+    from bench_preprocess import synthetic_jpeg
+    images = {name: synthetic_jpeg(width, height) for name, (width, height) in IMAGE_SIZES.items()}
+    results = {f'preprocessing/{key}': value for key, value in bench_preprocessing(images, repeat).items()}
+    for name, (backend, path) in models.items():
+        for threads in thread_counts:
+            print(f"Benchmarking {name} with threads={threads or 'default'}", file=sys.stderr)
+            backend_results = bench_backend(backend, path, threads, images, repeat, batch_sizes)
+            if 'error' in backend_results:
+                print(f"  skipped: {backend_results['error']}", file=sys.stderr)
+                continue
+            for key, value in backend_results.items():
+                results[f'{name}/threads_{threads or "default"}/{key}'] = value
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+# Flag measurements whose median got slower than the baseline by more than
+# threshold, and baseline measurements the current run no longer produced
+# (a backend that failed to load or crashed)
+def compare(current, baseline, threshold):
+    regressions = []
+    for key, reference in baseline['results'].items():
+        stats = current['results'].get(key)
+        if stats is None:
+            regressions.append((key, reference['p50_ms'], None, None))
+            continue
+        ratio = stats['p50_ms'] / reference['p50_ms'] if reference['p50_ms'] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append((key, reference['p50_ms'], stats['p50_ms'], ratio))
+    return regressions
+
+
+def print_results(report):
+    print(f"{'measurement':<60}{'p50 ms':>10}{'p90 ms':>10}")
+    for key, stats in report['results'].items():
+        print(f"{key:<60}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each inference stage across backends and thread settings.")
+    parser.add_argument('--threads', default='0', help="Comma-separated thread counts; 0 keeps the runtime default")
+    parser.add_argument('--batch-sizes', default=','.join(map(str, BATCH_SIZES)))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help="Baseline JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed p50 slowdown before flagging, e.g. 0.10 for 10%%")
+    args = parser.parse_args(argv)
+
+    thread_counts = [int(t) for t in args.threads.split(',')]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    report = run(default_models(), thread_counts, args.repeat, batch_sizes)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_results(report)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for key, before, after, ratio in regressions:
+            if after is None:
+                print(f"REGRESSION {key}: {before:.2f}ms -> missing")
+            else:
+                print(f"REGRESSION {key}: {before:.2f}ms -> {after:.2f}ms ({(ratio - 1) * 100:+.1f}%)")
+        if regressions:
+            return 1
+        print("No regressions against", args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+
+from inference import class_labels, healthy_labels
+
+# Define the knowledge base file; it is validated and compiled to one Markdown
+# block per class the first time this module is imported
+CLASS_INFO_PATH = os.environ.get(
+    'PLANT_CLASS_INFO_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class_info.json'))
+
+DISEASE_FIELDS = {'type': str, 'scientific_name': str, 'symptoms': list, 'causes': str,
+                  'treatment': list, 'prevention': list}
+HEALTHY_FIELDS = {'type': str, 'scientific_name': str, 'description': str, 'care': list}
+
+
+def validate(class_info):
+    problems = []
+    for label in class_labels:
+        if label not in class_info:
+            problems.append(f"{label}: missing")
+    for label, entry in class_info.items():
+        if label not in class_labels:
+            problems.append(f"{label}: not one of class_labels")
+            continue
+        fields = HEALTHY_FIELDS if label in healthy_labels else DISEASE_FIELDS
+        for field, kind in fields.items():
+            value = entry.get(field)
+            if not isinstance(value, kind) or not value:
+                problems.append(f"{label}: '{field}' must be a non-empty {kind.__name__}")
+            elif kind is list and not all(isinstance(item, str) for item in value):
+                problems.append(f"{label}: '{field}' must only contain strings")
+    if problems:
+        raise ValueError(f"Invalid knowledge base {CLASS_INFO_PATH}:\n" + '\n'.join(problems))
+
+
+def _section(title, value):
+    if isinstance(value, list):
+        value = '\n'.join(f"- {item}" for item in value)
+    return f"### {title}\n{value}"
+
+
+# Render one class the way main() used to with separate st.subheader/st.write calls
+def render_markdown(label, entry):
+    if label in healthy_labels:
+        sections = [
+            _section("Type:", entry['type']),
+            _section("Scientific Name:", entry['scientific_name']),
+            entry['description'],
+            _section("Care Tips:", entry['care']),
+        ]
+    else:
+        sections = [
+            _section("Type:", entry['type']),
+            _section("Scientific Name:", entry['scientific_name']),
+            _section("Symptoms:", entry['symptoms']),
+            _section("Cause:", entry['causes']),
+            _section("Treatment and Control:", entry['treatment']),
+            _section("Prevention:", entry['prevention']),
+        ]
+    return '\n\n'.join(sections)
+
+
+def load_class_info(path=CLASS_INFO_PATH):
+    with open(path, encoding='utf-8') as f:
+        class_info = json.load(f)
+    validate(class_info)
+    return class_info
+
+
+_start = time.perf_counter()
+class_info = load_class_info()
+rendered = {label: render_markdown(label, entry) for label, entry in class_info.items()}
+compile_seconds = time.perf_counter() - _start
+
+
+# The texts the previous per-field rendering sent, one Streamlit delta each
+def legacy_deltas(label):
+    entry = class_info[label]
+    if label in healthy_labels:
+        return []
+    deltas = []
+    for title, field in (("Type:", 'type'), ("Scientific Name:", 'scientific_name'), ("Symptoms:", 'symptoms'),
+                         ("Cause:", 'causes'), ("Treatment and Control:", 'treatment'), ("Prevention:", 'prevention')):
+        deltas.append(f"### {title}")
+        if isinstance(entry[field], list):
+            deltas.extend(f"- {item}" for item in entry[field])
+        else:
+            deltas.append(entry[field])
+    return deltas
+
+
+def payload_bytes(text):
+    # Size of the websocket message carrying one Markdown element, when Streamlit is available
+    try:
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    except ImportError:
+        return len(text.encode('utf-8'))
+    message = ForwardMsg()
+    message.delta.new_element.markdown.body = text
+    return message.ByteSize()
+
+
+def main():
+    print(f"Compiled {len(rendered)} classes in {compile_seconds * 1000:.2f}ms")
+    print(f"{'class':<32}{'deltas before':>14}{'bytes before':>14}{'deltas after':>14}{'bytes after':>13}")
+    for label in class_labels:
+        before = legacy_deltas(label)
+        print(f"{label:<32}{len(before):>14}{sum(payload_bytes(text) for text in before):>14}"
+              f"{1:>14}{payload_bytes(rendered[label]):>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+# Puts the repository root on sys.path so tests can import the top-level modules.
+# load_test.py is the HTTP load generator, not a test module.
+collect_ignore = ['load_test.py']
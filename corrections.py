@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from preprocessing import IMAGE_SIZE
+
+CORRECTIONS_DIR = os.environ.get('PLANT_CORRECTIONS_DIR', 'corrections')
+PIXEL_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+RECORD_BYTES = int(np.prod(PIXEL_SHAPE))
+
+
+class CorrectionStore:
+    # Append-only store of user corrections. Each correction is one JSON line
+    # (image hash, predicted and corrected label, record number) plus the
+    # model-input-size uint8 image appended to a flat pixel file, so records
+    # can be memory-mapped by position without decoding anything.
+
+    def __init__(self, directory=CORRECTIONS_DIR):
+        self.directory = directory
+        self.log_path = os.path.join(directory, 'corrections.jsonl')
+        self.pixels_path = os.path.join(directory, 'pixels.u8')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        if not os.path.exists(self.pixels_path):
+            return 0
+        return os.path.getsize(self.pixels_path) // RECORD_BYTES
+
+    def add(self, image_hash, pixels, predicted, corrected):
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        if pixels.shape != PIXEL_SHAPE:
+            raise ValueError(f"Expected pixels of shape {PIXEL_SHAPE}, got {pixels.shape}")
+        with self._lock:
+            record = len(self)
+            with open(self.pixels_path, 'ab') as f:
+                f.write(pixels.tobytes())
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({
+                    'hash': image_hash,
+                    'predicted': predicted,
+                    'corrected': corrected,
+                    'record': record,
+                    'time': time.time(),
+                }) + '\n')
+        return record
+
+    def entries(self):
+        # Latest correction per image, in record order
+        latest = {}
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest[entry['hash']] = entry
+        return sorted(latest.values(), key=lambda entry: entry['record'])
+
+    def pixels(self):
+        # Memory-map all stored images as an (N, 256, 256, 3) uint8 array
+        count = len(self)
+        if not count:
+            return np.empty((0,) + PIXEL_SHAPE, dtype=np.uint8)
+        return np.memmap(self.pixels_path, dtype=np.uint8, mode='r', shape=(count,) + PIXEL_SHAPE)
@@ -0,0 +1,29 @@
+import os
+import random
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Define the dataset locations used by the training notebook
+TRAIN_DIR = os.environ.get('PLANT_TRAIN_DIR', '/kaggle/input/plant-data/Train')
+VALID_DIR = os.environ.get('PLANT_VALID_DIR', '/kaggle/input/plant-data/Valid')
+
+
+# Class directories in the order flow_from_directory assigns label indices,
+# which is the order of the model's outputs and of class_labels
+def list_classes(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if os.path.isdir(os.path.join(directory, name)))
+
+
+# List (path, label index) pairs for a Train/Valid style directory, optionally
+# sampling at most per_class images from each class
+def list_labeled_images(directory, per_class=None, seed=0):
+    rng = random.Random(seed)
+    samples = []
+    for index, name in enumerate(list_classes(directory)):
+        class_dir = os.path.join(directory, name)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        if per_class is not None and len(files) > per_class:
+            files = sorted(rng.sample(files, per_class))
+        samples.extend((os.path.join(class_dir, f), index) for f in files)
+    return samples
@@ -0,0 +1,291 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import time
+
+import numpy as np
+
+import model_registry
+from dataset import TRAIN_DIR, VALID_DIR, list_classes
+from inference_engine import compile_model, configure_threads, time_calls
+from preprocessing import IMAGE_SIZE
+from train import build_dataset, throughput_callback
+
+logger = logging.getLogger(__name__)
+
+# Define the distillation defaults: students are MobileNetV2 with a width
+# multiplier and input resolution, named mnv2_a<width>_<resolution>
+DEFAULT_STUDENTS = 'mnv2_a0.5_160,mnv2_a0.75_192,mnv2_a1.0_160'
+TEMPERATURE = 4.0
+# Weight of the teacher's soft targets against the hard labels
+SOFT_WEIGHT = 0.7
+REPORT_PATH = 'distill_report.json'
+
+_STUDENT_NAME = re.compile(r'^mnv2_a(?P<width>[0-9.]+)_(?P<resolution>\d+)$')
+
+
+def parse_student(name):
+    match = _STUDENT_NAME.match(name)
+    if not match:
+        raise ValueError(f"Student names look like mnv2_a0.5_160, got {name!r}")
+    return float(match.group('width')), int(match.group('resolution'))
+
+
+# Same head as the teacher, so head retraining and the backends work unchanged.
+# The model still takes 256x256 inputs and downsamples them in its first layer,
+# so preprocessing, caches and the batch tools do not depend on the student.
+def build_student(width, resolution, num_classes, weights='imagenet'):
+    import tensorflow as tf
+    base_model = tf.keras.applications.MobileNetV2(alpha=width, weights=weights, include_top=False,
+                                                   input_shape=(resolution, resolution, 3))
+    return tf.keras.models.Sequential([
+        tf.keras.Input(shape=IMAGE_SIZE[::-1] + (3,)),
+        tf.keras.layers.Resizing(resolution, resolution),
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+
+
+# Both models end in a softmax, so soften their outputs through log-probabilities
+def soften(probabilities, temperature):
+    import tensorflow as tf
+    return tf.nn.softmax(tf.math.log(tf.clip_by_value(probabilities, 1e-7, 1.0)) / temperature)
+
+
+def distillation_loss(labels, teacher_probabilities, student_probabilities,
+                      temperature=TEMPERATURE, soft_weight=SOFT_WEIGHT):
+    import tensorflow as tf
+    soft = tf.keras.losses.kl_divergence(soften(teacher_probabilities, temperature),
+                                         soften(student_probabilities, temperature)) * temperature ** 2
+    hard = tf.keras.losses.categorical_crossentropy(labels, student_probabilities)
+    return tf.reduce_mean(soft_weight * soft + (1 - soft_weight) * hard)
+
+
+def build_distiller(student, teacher, temperature=TEMPERATURE, soft_weight=SOFT_WEIGHT):
+    import tensorflow as tf
+
+    class Distiller(tf.keras.Model):
+        # Trains the student on the frozen teacher's soft targets; validation
+        # reports the student alone against the hard labels
+
+        def __init__(self):
+            super().__init__()
+            self.student = student
+            self.teacher = teacher
+            self.teacher.trainable = False
+            # Averaged over the epoch like the built-in loss, so val_loss is not
+            # just the loss of the last (often partial) batch
+            self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+
+        @property
+        def metrics(self):
+            return [self.loss_tracker] + super().metrics
+
+        def call(self, images, training=False):
+            return self.student(images, training=training)
+
+        def train_step(self, data):
+            images, labels = data
+            teacher_probabilities = self.teacher(images, training=False)
+            with tf.GradientTape() as tape:
+                student_probabilities = self.student(images, training=True)
+                loss = distillation_loss(labels, teacher_probabilities, student_probabilities,
+                                         temperature, soft_weight)
+            variables = self.student.trainable_variables
+            self.optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+            self.loss_tracker.update_state(loss)
+            self.compiled_metrics.update_state(labels, student_probabilities)
+            return {metric.name: metric.result() for metric in self.metrics}
+
+        def test_step(self, data):
+            images, labels = data
+            student_probabilities = self.student(images, training=False)
+            self.loss_tracker.update_state(
+                tf.reduce_mean(tf.keras.losses.categorical_crossentropy(labels, student_probabilities)))
+            self.compiled_metrics.update_state(labels, student_probabilities)
+            return {metric.name: metric.result() for metric in self.metrics}
+
+    return Distiller()
+
+
+def distill(name, teacher, train_data, valid_data, steps, num_classes, batch_size, epochs, weights, checkpoint_dir):
+    import tensorflow as tf
+    width, resolution = parse_student(name)
+    student = build_student(width, resolution, num_classes, weights)
+    distiller = build_distiller(student, teacher)
+    distiller.compile(optimizer='adam', metrics=['accuracy'])
+    callbacks = [
+        tf.keras.callbacks.BackupAndRestore(os.path.join(checkpoint_dir, name)),
+        tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', patience=3, factor=0.1, min_lr=1e-6),
+        throughput_callback(batch_size, steps),
+    ]
+    distiller.fit(train_data, epochs=epochs, validation_data=valid_data, callbacks=callbacks)
+    return student
+
+
+# Forward-pass FLOPs for one image, counted on the frozen inference graph
+# (a multiply-add counts as two)
+def count_flops(model):
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+    spec = tf.TensorSpec((1,) + tuple(model.input_shape[1:]), tf.float32)
+    function = tf.function(lambda x: model(x, training=False)).get_concrete_function(spec)
+    graph = convert_variables_to_constants_v2(function).graph
+    options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+    options['output'] = 'none'
+    profile = tf.compat.v1.profiler.profile(graph=graph, run_meta=tf.compat.v1.RunMetadata(), cmd='op',
+                                            options=options)
+    return int(profile.total_float_ops)
+
+
+def per_class_accuracy(model, dataset, num_classes):
+    correct = np.zeros(num_classes, dtype=np.int64)
+    total = np.zeros(num_classes, dtype=np.int64)
+    for images, labels in dataset:
+        predicted = np.argmax(model.predict_on_batch(images.numpy()), axis=1)
+        actual = np.argmax(labels.numpy(), axis=1)
+        np.add.at(total, actual, 1)
+        np.add.at(correct, actual[predicted == actual], 1)
+    return correct, total
+
+
+def _measure_latency(path, threads, runs, queue):
+    # Runs in a fresh process: TensorFlow's thread pools are fixed once the
+    # first op runs, and training should keep the default pools
+    try:
+        import tensorflow as tf
+        configure_threads(threads, 1)
+        model = tf.keras.models.load_model(path, compile=False)
+        batch = np.random.default_rng(0).random((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+        queue.put(time_calls(compile_model(model, (1,)).predict_on_batch, batch, runs))
+    except Exception as e:
+        queue.put(e)
+
+
+# Single-image latency with the thread count of a CPU edge box
+def measure_latency(path, threads, runs):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure_latency, args=(path, threads, runs, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Latency measurement for {path} exited with code {process.exitcode}")
+    result = queue.get()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def evaluate(model, path, valid_data, class_names, threads, runs):
+    correct, total = per_class_accuracy(compile_model(model, ()), valid_data, len(class_names))
+    return {
+        'params': int(model.count_params()),
+        'flops': count_flops(model),
+        'latency_ms': measure_latency(path, threads, runs),
+        'accuracy': float(correct.sum() / max(total.sum(), 1)),
+        'per_class': {name: float(c / t) if t else None for name, c, t in zip(class_names, correct, total)},
+    }
+
+
+def print_report(report, class_names):
+    print(f"{'model':<18}{'params':>12}{'MFLOPs':>10}{'ms/image':>10}{'accuracy':>10}")
+    for name, row in report.items():
+        print(f"{name:<18}{row['params']:>12,}{row['flops'] / 1e6:>10.0f}{row['latency_ms']:>10.2f}"
+              f"{row['accuracy'] * 100:>9.1f}%")
+    print()
+    print(f"{'class':<32}" + ''.join(f"{name:>16}" for name in report))
+    for label in class_names:
+        cells = (row['per_class'][label] for row in report.values())
+        print(f"{label:<32}" + ''.join(f"{'-':>16}" if value is None else f"{value * 100:>15.1f}%" for value in cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distill smaller, lower-resolution students from the plant disease model.")
+    parser.add_argument('--teacher', default=model_registry.MODEL_PATH)
+    parser.add_argument('--students', default=DEFAULT_STUDENTS, help="Comma-separated mnv2_a<width>_<resolution> names")
+    parser.add_argument('--train-dir', default=TRAIN_DIR)
+    parser.add_argument('--valid-dir', default=VALID_DIR)
+    parser.add_argument('--output-dir', default=model_registry.STUDENTS_DIR)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--weights', default='imagenet', help="Student MobileNetV2 initialization ('imagenet' or 'none')")
+    parser.add_argument('--packed-dir', help="Read pre-resized shards from shards.py (<dir>/<train/valid dir name>) instead of JPEGs")
+    parser.add_argument('--cache-dir', default='.tf_cache', help="Where decoded, resized images are cached; '' caches in memory")
+    parser.add_argument('--checkpoint-dir', default='checkpoints/distill')
+    parser.add_argument('--report-only', action='store_true', help="Only report on students already in --output-dir")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Intra-op threads for the latency measurement only; training uses the default pools")
+    parser.add_argument('--runs', type=int, default=50, help="Timed single-image calls per model")
+    parser.add_argument('--report', default=REPORT_PATH)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(args.seed)
+
+    if args.packed_dir:
+        # Packed shards are already decoded and resized, so there is nothing to cache
+        from shards import PackedDataset, packed_path
+        from inference import class_labels
+        class_names = class_labels
+        train_packed = PackedDataset(packed_path(args.packed_dir, args.train_dir))
+        valid_data = PackedDataset(packed_path(args.packed_dir, args.valid_dir)).to_tf_dataset(args.batch_size, False)
+    else:
+        class_names = list_classes(args.valid_dir)
+        train_cache = valid_cache = ''
+        if args.cache_dir:
+            os.makedirs(args.cache_dir, exist_ok=True)
+            train_cache = os.path.join(args.cache_dir, 'train')
+            valid_cache = os.path.join(args.cache_dir, 'valid')
+        valid_data, _ = build_dataset(args.valid_dir, len(class_names), args.batch_size, False, valid_cache)
+    num_classes = len(class_names)
+
+    teacher = tf.keras.models.load_model(args.teacher, compile=False)
+    names = [name for name in args.students.split(',') if name]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if not args.report_only:
+        if args.packed_dir:
+            train_data, train_count = train_packed.to_tf_dataset(args.batch_size, True, args.seed), len(train_packed)
+        else:
+            train_data, train_count = build_dataset(args.train_dir, num_classes, args.batch_size, True,
+                                                    train_cache, seed=args.seed)
+        steps = math.ceil(train_count / args.batch_size)
+        weights = None if args.weights == 'none' else args.weights
+        for name in names:
+            start = time.perf_counter()
+            student = distill(name, teacher, train_data, valid_data, steps, num_classes, args.batch_size,
+                              args.epochs, weights, args.checkpoint_dir)
+            path = os.path.join(args.output_dir, name + '.keras')
+            student.save(path)
+            logger.info("Saved %s in %.0fs", path, time.perf_counter() - start)
+
+    report = {'teacher': evaluate(teacher, args.teacher, valid_data, class_names, args.threads, args.runs)}
+    for name in names:
+        path = os.path.join(args.output_dir, name + '.keras')
+        if not os.path.exists(path):
+            logger.warning("No student at %s", path)
+            continue
+        report[name] = evaluate(tf.keras.models.load_model(path, compile=False), path, valid_data, class_names,
+                                args.threads, args.runs)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report, class_names)
+    print("Wrote", args.report)
+    if names:
+        print("Serve a student with PLANT_STUDENT=" + names[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import model_registry
+from backends import load_backend
+from dataset import VALID_DIR, list_labeled_images
+from inference import BATCH_SIZE, iter_batches, predict_batch, prepare_image
+from preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+FP16_PATH = 'plant_disease_detection_model_fp16.tflite'
+INT8_PATH = 'plant_disease_detection_model_int8.tflite'
+ONNX_PATH = 'plant_disease_detection_model.onnx'
+
+
+# Yield preprocessed images from a sample of the Valid set to calibrate int8 ranges
+def representative_dataset(calibration_dir, per_class=10):
+    samples = list_labeled_images(calibration_dir, per_class=per_class, seed=1)
+    def generator():
+        for path, _ in samples:
+            yield [normalize(prepare_image(path))[np.newaxis]]
+    return generator
+
+
+def export_tflite(model, path, quantization, calibration_dir=VALID_DIR, per_class=10):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # Full integer quantization; input and output stay float32 so callers
+        # keep using the same preprocessing
+        converter.representative_dataset = representative_dataset(calibration_dir, per_class)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown quantization {quantization!r}")
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    logger.info("Wrote %s (%.1f MB)", path, os.path.getsize(path) / 1e6)
+    return path
+
+
+def export_onnx(model, path):
+    # tf2onnx is optional; skip the ONNX export when it is not installed
+    try:
+        import tf2onnx
+    except ImportError:
+        logger.warning("tf2onnx is not installed, skipping ONNX export")
+        return None
+    import tensorflow as tf
+    signature = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=signature, output_path=path)
+    logger.info("Wrote %s (%.1f MB)", path, os.path.getsize(path) / 1e6)
+    return path
+
+
+# Batches of (uint8 images, labels) decoded from (path, label) samples
+def decoded_batches(samples, batch_size=BATCH_SIZE):
+    for batch in iter_batches(samples, batch_size):
+        yield [prepare_image(path) for path, _ in batch], [label for _, label in batch]
+
+
+# Measure accuracy on a held-out set and single-image and batched latency for one
+# backend. batches returns a fresh iterator of (images, labels) on every call.
+def evaluate(model, batches, batch_size=BATCH_SIZE, latency_runs=50):
+    correct = total = 0
+    image = None
+    for images, labels in batches():
+        predictions = predict_batch(model, images, batch_size)
+        correct += int(np.sum(np.argmax(predictions, axis=1) == np.asarray(labels)))
+        total += len(labels)
+        if image is None:
+            image = np.array(images[0])
+
+    predict_batch(model, [image], 1)
+    start = time.perf_counter()
+    for _ in range(latency_runs):
+        predict_batch(model, [image], 1)
+    single_ms = (time.perf_counter() - start) / latency_runs * 1000
+
+    images = [image] * batch_size
+    predict_batch(model, images, batch_size)
+    runs = max(1, latency_runs // batch_size)
+    start = time.perf_counter()
+    for _ in range(runs):
+        predict_batch(model, images, batch_size)
+    batched_ms = (time.perf_counter() - start) / (runs * batch_size) * 1000
+
+    return {
+        'accuracy': correct / total,
+        'latency_ms_batch_1': single_ms,
+        f'latency_ms_per_image_batch_{batch_size}': batched_ms,
+    }
+
+
+def compare(models, eval_dir, per_class=None, batch_size=BATCH_SIZE, packed_dir=None):
+    if packed_dir:
+        # Read the evaluation set from packed shards instead of decoding every JPEG
+        from shards import PackedDataset, packed_path, sample_records
+        packed = PackedDataset(packed_path(packed_dir, eval_dir))
+        records = sample_records(packed, per_class, seed=2)
+
+        def batches():
+            return packed.iter_batches(batch_size, records=records)
+    else:
+        samples = list_labeled_images(eval_dir, per_class=per_class, seed=2)
+
+        def batches():
+            return decoded_batches(samples, batch_size)
+
+    results = {}
+    for name, (backend, path) in models.items():
+        if not path or not os.path.exists(path):
+            continue
+        logger.info("Evaluating %s", name)
+        result = evaluate(load_backend(backend, path), batches, batch_size)
+        result['size_mb'] = (os.path.getsize(path) if os.path.isfile(path) else 0) / 1e6
+        results[name] = result
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export quantized TFLite/ONNX models and compare them with the Keras model.")
+    parser.add_argument('--model', default=model_registry.MODEL_PATH)
+    parser.add_argument('--calibration-dir', default=VALID_DIR, help="Directory sampled to calibrate int8 ranges")
+    parser.add_argument('--calibration-per-class', type=int, default=10)
+    parser.add_argument('--eval-dir', default=VALID_DIR, help="Held-out directory for the accuracy comparison")
+    parser.add_argument('--eval-per-class', type=int, help="Limit evaluation images per class")
+    parser.add_argument('--packed-dir', help="Read the evaluation set from shards.py shards (<dir>/<eval dir name>) instead of JPEGs")
+    parser.add_argument('--skip-export', action='store_true', help="Only run the comparison")
+    parser.add_argument('--skip-compare', action='store_true', help="Only export the models")
+    parser.add_argument('--report', default='backend_comparison.json')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    onnx_path = ONNX_PATH
+    if not args.skip_export:
+        model = model_registry.load_model(args.model, 'keras')
+        export_tflite(model, FP16_PATH, 'float16')
+        export_tflite(model, INT8_PATH, 'int8', args.calibration_dir, args.calibration_per_class)
+        onnx_path = export_onnx(model, ONNX_PATH)
+
+    if args.skip_compare:
+        return
+    results = compare({
+        'keras': ('keras', args.model),
+        'tflite_fp16': ('tflite', FP16_PATH),
+        'tflite_int8': ('tflite', INT8_PATH),
+        'onnx': ('onnx', onnx_path),
+    }, args.eval_dir, args.eval_per_class, packed_dir=args.packed_dir)
+    with open(args.report, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'backend':<14}{'accuracy':>10}{'batch 1 ms':>12}{'batched ms':>12}{'size MB':>10}")
+    for name, result in results.items():
+        batched = next(v for k, v in result.items() if k.startswith('latency_ms_per_image_batch_'))
+        print(f"{name:<14}{result['accuracy']:>10.4f}{result['latency_ms_batch_1']:>12.2f}{batched:>12.2f}{result['size_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from corrections import CorrectionStore
+from dataset import TRAIN_DIR, list_labeled_images
+from inference import class_labels, prepare_image
+from preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+HEAD_DIR = os.environ.get('PLANT_HEAD_DIR', 'corrections')
+# Original training images mixed into every retrain so the head does not forget
+# uncorrected classes. Once embedded, the anchor set is cached next to the
+# corrections and can be shipped without the images.
+ANCHOR_DIR = os.environ.get('PLANT_ANCHOR_DIR', TRAIN_DIR)
+EMBEDDING_BATCH_SIZE = 32
+
+_train_lock = threading.Lock()
+
+
+class MissingAnchors(Exception):
+    pass
+
+
+# Models are Sequential([..., MobileNetV2, GlobalAveragePooling2D, Dense(128),
+# Dropout, Dense(19), ...]); everything up to the pooling layer produces the
+# embedding, the Dense layers after it are the head
+def _pooling_index(model):
+    import tensorflow as tf
+    for index, layer in enumerate(model.layers):
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            return index
+    raise ValueError("Model has no GlobalAveragePooling2D layer to split the head at")
+
+
+def feature_model(model):
+    import tensorflow as tf
+    return tf.keras.Sequential(model.layers[:_pooling_index(model) + 1])
+
+
+def embedding_size(model):
+    return model.layers[_pooling_index(model)].output_shape[-1]
+
+
+def head_layers(model):
+    import tensorflow as tf
+    return [layer for layer in model.layers[_pooling_index(model) + 1:] if isinstance(layer, tf.keras.layers.Dense)]
+
+
+# Identify the frozen feature extractor, so heads and embedding caches are never
+# mixed between different base models (e.g. the teacher and a distilled student)
+def model_key(model):
+    first = next(layer for layer in model.layers[:_pooling_index(model)] if layer.weights)
+    return hashlib.sha256(np.ascontiguousarray(first.weights[0].numpy()).tobytes()).hexdigest()[:12]
+
+
+def head_path(model):
+    return os.path.join(HEAD_DIR, f'head_{model_key(model)}.npz')
+
+
+def head_weights(model):
+    return [w for layer in head_layers(model) for w in layer.get_weights()]
+
+
+def build_head(model):
+    import tensorflow as tf
+    dense, output = head_layers(model)
+    head = tf.keras.Sequential([
+        tf.keras.Input(shape=(embedding_size(model),)),
+        tf.keras.layers.Dense(dense.units, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(output.units, activation='softmax'),
+    ])
+    head.set_weights(head_weights(model))
+    return head
+
+
+class EmbeddingCache:
+    # Append-only float32 embeddings for a growing list of images, memory-mapped
+    # for training. Only images beyond the cached count are run through the base.
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.size * 4)
+
+    def extend(self, extractor, images):
+        # `images` is a sequence of uint8 images; embed those not yet cached
+        start = len(self)
+        with open(self.path, 'ab') as f:
+            for offset in range(start, len(images), EMBEDDING_BATCH_SIZE):
+                batch = normalize(np.asarray(images[offset:offset + EMBEDDING_BATCH_SIZE]))
+                embeddings = np.asarray(extractor.predict_on_batch(batch), dtype=np.float32)
+                f.write(embeddings.tobytes())
+        return self.array()
+
+    def array(self):
+        count = len(self)
+        if not count:
+            return np.empty((0, self.size), dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=(count, self.size))
+
+
+class _LazyImages:
+    # Sequence view that decodes anchor images only when they need embedding
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return [prepare_image(path) for path in self.paths[index]]
+
+
+# Embeddings and labels of the anchor sample, from the anchor directory or, when
+# it is not available (e.g. in deployment), from a previously shipped cache
+def load_anchors(extractor, store, key, size, anchor_dir=None, per_class=20):
+    anchor_cache = EmbeddingCache(os.path.join(store.directory, f'anchor_{key}_{per_class}.f32'), size)
+    labels_path = os.path.join(store.directory, f'anchor_{key}_{per_class}.labels.npy')
+    if anchor_dir and os.path.isdir(anchor_dir):
+        samples = list_labeled_images(anchor_dir, per_class=per_class, seed=3)
+        embeddings = anchor_cache.extend(extractor, _LazyImages([path for path, _ in samples]))
+        labels = np.array([label for _, label in samples], dtype=np.int64)
+        np.save(labels_path, labels)
+        return embeddings, labels
+    if os.path.exists(labels_path):
+        labels = np.load(labels_path)
+        if len(labels) == len(anchor_cache):
+            return anchor_cache.array(), labels
+    return None
+
+
+def load_training_set(model, store, anchor_dir=None, per_class=20):
+    extractor = feature_model(model)
+    size = embedding_size(model)
+    key = model_key(model)
+
+    cache = EmbeddingCache(os.path.join(store.directory, f'embeddings_{key}.f32'), size)
+    embeddings = cache.extend(extractor, store.pixels())
+    entries = store.entries()
+    x = [embeddings[[entry['record'] for entry in entries]]]
+    y = [np.array([class_labels.index(entry['corrected']) for entry in entries], dtype=np.int64)]
+
+    # Mix in a fixed sample of the original training set so the head does not
+    # forget the classes nobody corrected
+    anchors = load_anchors(extractor, store, key, size, anchor_dir, per_class)
+    if anchors is None:
+        logger.warning("No anchor set: %s does not exist and no cached anchor embeddings were found in %s",
+                       anchor_dir, store.directory)
+    else:
+        x.append(anchors[0])
+        y.append(anchors[1])
+    return np.concatenate(x), np.concatenate(y), anchors is not None
+
+
+# Retrain the Dense(128)/softmax head on cached embeddings, starting from the current weights.
+# Without anchors the head would be fitted to the corrections alone, so that
+# raises MissingAnchors unless require_anchors is False.
+def train_head(model, store, anchor_dir=ANCHOR_DIR, per_class=20, epochs=20, learning_rate=1e-4,
+               require_anchors=True):
+    import tensorflow as tf
+    with _train_lock:
+        start = time.perf_counter()
+        x, y, anchored = load_training_set(model, store, anchor_dir, per_class)
+        if not anchored and require_anchors:
+            raise MissingAnchors(f"No anchor images in {anchor_dir} and no cached anchor embeddings")
+        if not len(x):
+            return None
+        head = build_head(model)
+        head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate),
+                     loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        head.fit(x, y, epochs=epochs, batch_size=32, shuffle=True, verbose=0)
+        logger.info("Trained head on %d embeddings in %.1fs", len(x), time.perf_counter() - start)
+        return head.get_weights()
+
+
+# Swap new head weights into the running model; the next prediction uses them
+def apply_head(model, weights):
+    for layer in head_layers(model):
+        count = len(layer.get_weights())
+        layer.set_weights(weights[:count])
+        weights = weights[count:]
+
+
+def head_version(weights):
+    digest = hashlib.sha256()
+    for w in weights:
+        digest.update(np.ascontiguousarray(w).tobytes())
+    return digest.hexdigest()[:12]
+
+
+def save_head(weights, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, *weights)
+    os.replace(tmp_path, path)
+
+
+def load_head(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return [data[f'arr_{i}'] for i in range(len(data.files))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retrain the classifier head on stored corrections.")
+    parser.add_argument('--anchor-dir', default=ANCHOR_DIR, help="Original training set sampled to avoid forgetting")
+    parser.add_argument('--allow-no-anchors', action='store_true', help="Retrain on the corrections alone")
+    parser.add_argument('--per-class', type=int, default=20)
+    parser.add_argument('--epochs', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import model_registry
+    logging.basicConfig(level=logging.INFO)
+    model = model_registry.load_model(backend='keras')
+    weights = train_head(model, CorrectionStore(), args.anchor_dir, args.per_class, args.epochs,
+                         require_anchors=not args.allow_no_anchors)
+    if weights is None:
+        print("No corrections recorded")
+        return
+    save_head(weights, head_path(model))
+    print("Saved head", head_version(weights), "to", head_path(model))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from preprocessing import IMAGE_SIZE, batch_input_buffer, decode_to_array, normalize
+
+# Define the class labels
+class_labels = [
+    'Bell Pepper Bacterial Spot', 'Bell Pepper Healthy', 'Corn Common Rust',
+    'Corn Gray Leaf Spot', 'Corn Healthy', 'Corn Northern Leaf Blight',
+    'Potato Early Blight', 'Potato Healthy', 'Potato Late Blight',
+    'Tomato Bacterial Spot', 'Tomato Early Blight', 'Tomato Healthy',
+    'Tomato Late Blight', 'Tomato Leaf Mold', 'Tomato Septoria Leaf Spot',
+    'Tomato Spider Mites', 'Tomato Target Spot', 'Tomato Mosaic Virus',
+    'Tomato Yellow Leaf Curl Virus'
+]
+healthy_labels = [
+    'Bell Pepper Healthy', 'Corn Healthy', 'Potato Healthy', 'Tomato Healthy'
+]
+plant_labels=["Bell Pepper","Corn","Potato","Tomato"]
+
+# Define the fixed batch size used for batched inference
+BATCH_SIZE = int(os.environ.get('PLANT_BATCH_SIZE', '16'))
+DECODE_WORKERS = int(os.environ.get('PLANT_DECODE_WORKERS', str(os.cpu_count() or 1)))
+
+# Define the function to preprocess the input image
+def preprocess_image(img):
+    img = img.resize(IMAGE_SIZE)
+    img = np.asarray(img, dtype=np.float32)
+    img = np.expand_dims(img, axis=0)
+    img = img / 255.0  # Normalize the image
+    return img
+
+# Decode raw image bytes (or a path) to an RGB PIL image
+def load_image(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return Image.open(source).convert('RGB')
+
+# Decode one image to a (256, 256, 3) uint8 array, optionally straight into a
+# preallocated slot; normalization happens in predict_batch
+def prepare_image(source, out=None):
+    with metrics.timed('decode'):
+        return decode_to_array(source, out)
+
+# Decode and preprocess several images in parallel, keeping input order
+def prepare_images(sources, executor=None):
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+            return list(pool.map(prepare_image, sources))
+    return list(executor.map(prepare_image, sources))
+
+# Split a sequence into consecutive chunks of at most batch_size items
+def iter_batches(items, batch_size=BATCH_SIZE):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+# Run one forward pass over up to batch_size prepared images. Short batches are
+# padded to the fixed batch size so the model always sees the same input shape.
+# uint8 images are normalized straight into a reused float32 buffer; float
+# images are taken as already normalized. Callers that aggregate several
+# forward passes into one answer (tiling) pass record=False and record that.
+def predict_batch(model, images, batch_size=BATCH_SIZE, record=True):
+    count = len(images)
+    with metrics.timed('normalize'):
+        batch = batch_input_buffer((max(batch_size, count),) + IMAGE_SIZE[::-1] + (3,))
+        for i, img in enumerate(images):
+            if img.dtype == np.uint8:
+                normalize(img, batch[i])
+            else:
+                batch[i] = img
+    with metrics.timed('forward'):
+        predictions = np.asarray(model.predict_on_batch(batch))[:count]
+    if record:
+        indices = np.argmax(predictions, axis=1)
+        metrics.record_predictions([class_labels[i] for i in indices], predictions[np.arange(count), indices])
+    return predictions
+
+# Map a prediction vector to its class label and confidence
+def top_prediction(predictions):
+    index = int(np.argmax(predictions))
+    return class_labels[index], float(predictions[index])
@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from inference import BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Define the engine settings: XLA compilation, the batch sizes traced at load
+# time, and the TensorFlow thread pools (0 keeps TensorFlow's default)
+JIT_COMPILE = os.environ.get('PLANT_XLA', '0') == '1'
+WARMUP_BATCH_SIZES = tuple(int(b) for b in os.environ.get('PLANT_WARMUP_BATCH_SIZES', f'1,{BATCH_SIZE}').split(',') if b)
+INTRA_OP_THREADS = int(os.environ.get('PLANT_INTRA_OP_THREADS', '0'))
+INTER_OP_THREADS = int(os.environ.get('PLANT_INTER_OP_THREADS', '0'))
+
+
+# Must run before TensorFlow executes its first op
+def configure_threads(intra_op=INTRA_OP_THREADS, inter_op=INTER_OP_THREADS):
+    import tensorflow as tf
+    try:
+        if intra_op:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        logger.warning("Thread settings ignored, TensorFlow is already initialized: %s", e)
+
+
+class CompiledModel:
+    # A Keras model behind a tf.function with a fixed input signature, traced and
+    # warmed up once at load time. model.predict builds a data adapter and runs
+    # the callback machinery on every call; this calls the graph directly.
+    # Other attributes (layers, get_weights, ...) are forwarded to the model, and
+    # the graph reads the model's variables, so head hot-swaps take effect.
+
+    def __init__(self, model, jit_compile=JIT_COMPILE):
+        import tensorflow as tf
+        self.model = model
+        self.jit_compile = jit_compile
+        signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32)]
+        self._predict = tf.function(lambda x: model(x, training=False),
+                                    input_signature=signature, jit_compile=jit_compile)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def predict_on_batch(self, batch):
+        return self._predict(batch).numpy()
+
+    def warmup(self, batch_sizes=WARMUP_BATCH_SIZES):
+        # Trace the graph and, with XLA, compile each padded batch shape up front
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            self.predict_on_batch(np.zeros((batch_size,) + tuple(self.model.input_shape[1:]), dtype=np.float32))
+            logger.info("Warmed up batch size %d in %.2fs", batch_size, time.perf_counter() - start)
+        return self
+
+
+def compile_model(model, batch_sizes=WARMUP_BATCH_SIZES, jit_compile=JIT_COMPILE):
+    return CompiledModel(model, jit_compile).warmup(batch_sizes)
+
+
+def time_calls(function, batch, runs):
+    function(batch)
+    start = time.perf_counter()
+    for _ in range(runs):
+        function(batch)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare single-image latency of model.predict and the compiled engine.")
+    parser.add_argument('--model', help="Model path (defaults to the model registry's choice)")
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--xla', action='store_true', help="Also measure the XLA-compiled engine")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    import model_registry
+    configure_threads()
+    model = model_registry.load_model(args.model, 'keras')
+    batch = np.random.default_rng(0).random((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+
+    results = {
+        'model.predict': time_calls(lambda x: model.predict(x, verbose=0), batch, args.runs),
+        'model.predict_on_batch': time_calls(model.predict_on_batch, batch, args.runs),
+        'compiled': time_calls(compile_model(model, (1,), False).predict_on_batch, batch, args.runs),
+    }
+    if args.xla:
+        results['compiled + XLA'] = time_calls(compile_model(model, (1,), True).predict_on_batch, batch, args.runs)
+    for name, ms in results.items():
+        print(f"{name:<24}{ms:>8.2f} ms/image")
+
+
+if __name__ == '__main__':
+    main()
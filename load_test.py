@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import io
+import time
+
+import aiohttp
+import numpy as np
+from PIL import Image
+
+
+# Build a synthetic JPEG of phone-camera size when no sample image is given
+def synthetic_image(width=1024, height=768, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+async def run(url, data, total, concurrency):
+    latencies = []
+    statuses = {}
+    counter = iter(range(total))
+
+    async def client(session):
+        for _ in counter:
+            start = time.perf_counter()
+            async with session.post(url, data=data, headers={'Content-Type': 'application/octet-stream'}) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return time.perf_counter() - start, np.asarray(latencies) * 1000, statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for the inference server.")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/predict')
+    parser.add_argument('--image', help="Image to send (defaults to a synthetic JPEG)")
+    parser.add_argument('-n', '--requests', type=int, default=500)
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            data = f.read()
+    else:
+        data = synthetic_image()
+
+    elapsed, latencies, statuses = asyncio.run(run(args.url, data, args.requests, args.concurrency))
+    print(f"{len(latencies)} requests in {elapsed:.2f}s: {len(latencies) / elapsed:.1f} requests/sec")
+    print(f"p50 {np.percentile(latencies, 50):.1f}ms, p99 {np.percentile(latencies, 99):.1f}ms")
+    print("Status codes:", statuses)
+
+
+if __name__ == '__main__':
+    main()
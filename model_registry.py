@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Process start, used to report startup time and time to first prediction
+PROCESS_START = time.perf_counter()
+
+# Define the model locations. The Keras v3 file (or a SavedModel directory)
+# loads considerably faster than the legacy H5 file and is preferred when present,
+# unless PLANT_MODEL_PATH is set explicitly or the H5 file is newer.
+MODEL_PATH_SET = 'PLANT_MODEL_PATH' in os.environ
+MODEL_PATH = os.environ.get('PLANT_MODEL_PATH', 'plant_disease_detection_model.h5')
+FAST_MODEL_PATH = os.environ.get('PLANT_FAST_MODEL_PATH', 'plant_disease_detection_model.keras')
+
+# Define the distilled student to serve instead of the full model, by name
+# (e.g. mnv2_a0.5_160, see distill.py) or path; unset serves the full model
+STUDENTS_DIR = os.environ.get('PLANT_STUDENTS_DIR', 'students')
+STUDENT = os.environ.get('PLANT_STUDENT')
+
+# Define the inference backend (keras, tflite or onnx) and the model file used by
+# the lightweight backends; see export_models.py for producing them
+BACKEND = os.environ.get('PLANT_BACKEND', 'keras')
+BACKEND_MODEL_PATHS = {
+    'tflite': os.environ.get('PLANT_TFLITE_MODEL_PATH', 'plant_disease_detection_model_int8.tflite'),
+    'onnx': os.environ.get('PLANT_ONNX_MODEL_PATH', 'plant_disease_detection_model.onnx'),
+}
+
+# Serve the Keras model through the compiled, warmed-up inference engine
+COMPILE = os.environ.get('PLANT_COMPILE', '1') == '1'
+
+# Timings collected while loading the model and serving the first prediction
+timings = {}
+
+_model = None
+_lock = threading.Lock()
+
+
+def student_path(name):
+    if name.endswith('.keras') or os.path.sep in name:
+        return name
+    return os.path.join(STUDENTS_DIR, name + '.keras')
+
+
+def resolve_model_path():
+    if STUDENT:
+        return student_path(STUDENT)
+    if MODEL_PATH_SET or not FAST_MODEL_PATH or not os.path.exists(FAST_MODEL_PATH):
+        return MODEL_PATH
+    if os.path.exists(MODEL_PATH) and os.path.getmtime(FAST_MODEL_PATH) < os.path.getmtime(MODEL_PATH):
+        # train.py wrote a new H5 after the last conversion
+        logger.warning("%s is older than %s, loading the H5 file; run model_registry.py to re-convert",
+                       FAST_MODEL_PATH, MODEL_PATH)
+        return MODEL_PATH
+    return FAST_MODEL_PATH
+
+
+# Identify the base model by backend, file and modification time, so predictions
+# spilled to PLANT_CACHE_DIR are not reused after the model file, backend or
+# quantization changes
+def base_version(backend=None, path=None):
+    backend = backend or BACKEND
+    path = path or (resolve_model_path() if backend == 'keras' else BACKEND_MODEL_PATHS[backend])
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+    digest = hashlib.sha256(f'{backend}:{os.path.abspath(path)}:{mtime}'.encode()).hexdigest()[:12]
+    return f'{backend}-{os.path.splitext(os.path.basename(path))[0]}-{digest}'
+
+
+# Version of the serving weights: the base model plus the retrained head swapped
+# in, if any. It is part of prediction cache keys so stale predictions are never reused.
+base_model_version = base_version()
+model_version = base_model_version
+
+
+def load_model(path=None, backend=None):
+    global base_model_version, model_version
+    backend = backend or BACKEND
+    if backend != 'keras':
+        from backends import load_backend
+        path = path or BACKEND_MODEL_PATHS[backend]
+        start = time.perf_counter()
+        model = load_backend(backend, path)
+        base_model_version = model_version = base_version(backend, path)
+        timings['model_load_s'] = time.perf_counter() - start
+        timings['model_path'] = path
+        logger.info("Loaded %s model from %s in %.2fs", backend, path, timings['model_load_s'])
+        return model
+
+    path = path or resolve_model_path()
+
+    # TensorFlow is imported here so the UI shell can render before it is loaded
+    start = time.perf_counter()
+    import tensorflow as tf
+    from inference_engine import configure_threads
+    configure_threads()
+    timings['tf_import_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # The model is only used for inference, so skip restoring the optimizer state
+    model = tf.keras.models.load_model(path, compile=False)
+    base_model_version = model_version = base_version(backend, path)
+    timings['model_load_s'] = time.perf_counter() - start
+    timings['model_path'] = path
+    logger.info("Loaded model from %s in %.2fs (TensorFlow import %.2fs)",
+                path, timings['model_load_s'], timings['tf_import_s'])
+
+    # Apply the head retrained from user corrections, if there is one
+    from head_trainer import apply_head, head_path, head_version, load_head
+    head = load_head(head_path(model))
+    if head is not None:
+        apply_head(model, head)
+        model_version = f'{base_model_version}-head-{head_version(head)}'
+        logger.info("Applied retrained head %s", model_version)
+    return model
+
+
+def get_model():
+    # Load the model once per process; concurrent callers wait for the first load
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                model = load_model()
+                if COMPILE and BACKEND == 'keras':
+                    from inference_engine import compile_model
+                    start = time.perf_counter()
+                    model = compile_model(model)
+                    timings['warmup_s'] = time.perf_counter() - start
+                _model = model
+                timings['startup_s'] = time.perf_counter() - PROCESS_START
+    return _model
+
+
+def update_head(weights):
+    # Hot-swap a retrained head into the running model and persist it for restarts
+    global model_version
+    from head_trainer import apply_head, head_path, head_version, save_head
+    model = get_model()
+    apply_head(model, weights)
+    save_head(weights, head_path(model))
+    model_version = f'{base_model_version}-head-{head_version(weights)}'
+
+
+def record_prediction():
+    # Record the time from process start to the first prediction served
+    if 'first_prediction_s' not in timings:
+        timings['first_prediction_s'] = time.perf_counter() - PROCESS_START
+        logger.info("First prediction served %.2fs after startup", timings['first_prediction_s'])
+
+
+def convert_model(src=MODEL_PATH, dst=FAST_MODEL_PATH):
+    # Convert the H5 model to the faster loading format. A destination ending in
+    # '.keras' is saved in the Keras v3 format, anything else as a SavedModel.
+    import tensorflow as tf
+    model = tf.keras.models.load_model(src, compile=False)
+    if dst.endswith('.keras'):
+        model.save(dst)
+    else:
+        model.save(dst, save_format='tf')
+    return dst
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print("Saved", convert_model())
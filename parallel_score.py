@@ -0,0 +1,262 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backends import BACKENDS
+from batch_score import ResultWriter, iter_image_paths, read_completed
+from inference import BATCH_SIZE
+from preprocessing import IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+PIXEL_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+
+
+def _attach(name):
+    # Spawned children share the parent's resource tracker, which keeps the
+    # parent's registration; the parent alone unlinks the segments
+    return shared_memory.SharedMemory(name=name)
+
+
+def _decoder(tasks, ready, free_slots, slot_names, batch_size):
+    # Decode batches of paths straight into free shared-memory slots
+    from inference import prepare_image
+    segments = [_attach(name) for name in slot_names]
+    slots = [np.ndarray((batch_size,) + PIXEL_SHAPE, dtype=np.uint8, buffer=s.buf) for s in segments]
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, paths = task
+        slot = free_slots.get()
+        ok = []
+        for i, path in enumerate(paths):
+            try:
+                prepare_image(path, slots[slot][i])
+                ok.append(True)
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).warning("Skipping %s: %s", path, e)
+                ok.append(False)
+        ready.put((seq, slot, ok))
+    for segment in segments:
+        segment.close()
+
+
+def _inference_worker(ready, results, free_slots, loaded, slot_names, batch_size, model_path, backend, threads, cpus):
+    # One model per process with pinned thread counts, reading batches from shared memory
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    import model_registry
+    from inference import predict_batch
+    if backend == 'keras':
+        from inference_engine import compile_model, configure_threads
+        if threads:
+            configure_threads(threads, 1)
+        model = compile_model(model_registry.load_model(model_path, 'keras'), (batch_size,))
+    else:
+        from backends import load_backend
+        model = load_backend(backend, model_path or model_registry.BACKEND_MODEL_PATHS[backend], threads)
+    # Tell the parent the model is loaded and warmed up, so the clock excludes it
+    loaded.put(os.getpid())
+
+    segments = [_attach(name) for name in slot_names]
+    slots = [np.ndarray((batch_size,) + PIXEL_SHAPE, dtype=np.uint8, buffer=s.buf) for s in segments]
+    while True:
+        item = ready.get()
+        if item is None:
+            break
+        seq, slot, ok = item
+        rows = [i for i, valid in enumerate(ok) if valid]
+        predictions = predict_batch(model, [slots[slot][i] for i in rows], batch_size) if rows else np.empty((0,))
+        # The slot is free as soon as predict_batch has copied it into its input buffer
+        free_slots.put(slot)
+        results.put((seq, rows, predictions))
+    for segment in segments:
+        segment.close()
+
+
+def _cpu_sets(workers, threads):
+    # Give each worker its own contiguous block of cores when pinning is possible
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * workers
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = threads or max(1, len(cpus) // workers)
+    if per_worker * workers > len(cpus):
+        return [None] * workers
+    return [set(cpus[i * per_worker:(i + 1) * per_worker]) for i in range(workers)]
+
+
+def score_parallel(paths, output, model_path=None, backend='keras', workers=2, decoders=None, threads=None,
+                   batch_size=BATCH_SIZE, top_k=3, slots_per_worker=2, pin=False):
+    context = multiprocessing.get_context('spawn')
+    decoders = decoders or max(1, (os.cpu_count() or 2) // 2)
+    completed = read_completed(output)
+    if completed:
+        logger.info("Resuming: %d images already scored in %s", len(completed), output)
+    paths = (p for p in paths if p not in completed)
+
+    slot_count = workers * slots_per_worker + decoders
+    slot_bytes = batch_size * int(np.prod(PIXEL_SHAPE))
+    segments = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slot_count)]
+    slot_names = [segment.name for segment in segments]
+
+    tasks = context.Queue(maxsize=decoders * 2)
+    ready = context.Queue()
+    results = context.Queue()
+    free_slots = context.Queue()
+    loaded = context.Queue()
+    for slot in range(slot_count):
+        free_slots.put(slot)
+
+    cpu_sets = _cpu_sets(workers, threads) if pin else [None] * workers
+    processes = [context.Process(target=_decoder, args=(tasks, ready, free_slots, slot_names, batch_size), daemon=True)
+                 for _ in range(decoders)]
+    processes += [context.Process(target=_inference_worker,
+                                  args=(ready, results, free_slots, loaded, slot_names, batch_size, model_path,
+                                        backend, threads, cpu_sets[i]), daemon=True)
+                  for i in range(workers)]
+    load_start = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    def check_processes():
+        if any(not p.is_alive() and p.exitcode not in (0, None) for p in processes):
+            raise RuntimeError("A scoring process died")
+
+    # Feed batches from a thread so results are collected while tasks are queued;
+    # the bounded task queue and slot pool keep memory independent of input size
+    batches = {}
+    fed = {'count': None}
+
+    def feed():
+        seq = 0
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) == batch_size:
+                batches[seq] = batch
+                tasks.put((seq, batch))
+                seq += 1
+                batch = []
+        if batch:
+            batches[seq] = batch
+            tasks.put((seq, batch))
+            seq += 1
+        for _ in range(decoders):
+            tasks.put(None)
+        fed['count'] = seq
+
+    feeder = threading.Thread(target=feed, daemon=True)
+
+    # Write results in input order regardless of which worker finished first
+    writer = ResultWriter(output)
+    pending = {}
+    next_seq = 0
+    scored = 0
+    try:
+        # Start the clock once every worker has loaded its model
+        for _ in range(workers):
+            while True:
+                try:
+                    loaded.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    check_processes()
+        load_time = time.perf_counter() - load_start
+        logger.info("%d inference workers ready in %.1fs", workers, load_time)
+        start = time.perf_counter()
+        feeder.start()
+
+        while fed['count'] is None or next_seq < fed['count']:
+            try:
+                seq, rows, predictions = results.get(timeout=0.5)
+            except queue.Empty:
+                check_processes()
+                continue
+            pending[seq] = (rows, predictions)
+            while next_seq in pending:
+                rows, predictions = pending.pop(next_seq)
+                batch = batches.pop(next_seq)
+                for row, prediction in zip(rows, predictions):
+                    writer.write(batch[row], prediction, top_k)
+                writer.flush()
+                scored += len(rows)
+                next_seq += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        writer.close()
+        for _ in range(workers):
+            ready.put(None)
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    return scored, elapsed, load_time
+
+
+def scaling_report(paths, worker_counts, **kwargs):
+    # Score the same images with each worker count and report throughput; model
+    # load and warm-up happen before the clock starts and are reported apart
+    rows = []
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            scored, elapsed, load_time = score_parallel(iter(paths), os.path.join(directory, 'out.csv'),
+                                                        workers=workers, **kwargs)
+        rows.append((workers, scored, load_time, elapsed, scored / elapsed if elapsed else 0.0))
+    base = rows[0][4] or 1.0
+    print(f"{'workers':>8}{'images':>8}{'load s':>9}{'seconds':>10}{'images/sec':>12}{'speedup':>9}")
+    for workers, scored, load_time, elapsed, rate in rows:
+        print(f"{workers:>8}{scored:>8}{load_time:>9.1f}{elapsed:>10.1f}{rate:>12.1f}{rate / base:>9.2f}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score large image archives with a pool of model processes.")
+    parser.add_argument('inputs', nargs='*', help="Image directories or files")
+    parser.add_argument('--file-list', help="Text file with one image path per line")
+    parser.add_argument('-o', '--output', help="Output file (.csv or .jsonl); appended to and resumed if it exists")
+    parser.add_argument('--model', help="Model path (defaults to the model registry's choice)")
+    parser.add_argument('--backend', choices=BACKENDS, default=os.environ.get('PLANT_BACKEND', 'keras'))
+    parser.add_argument('--workers', type=int, default=2, help="Inference processes, each with its own model")
+    parser.add_argument('--decoders', type=int, help="Decode processes (default: half the cores)")
+    parser.add_argument('--threads', type=int, help="Intra-op threads per inference process")
+    parser.add_argument('--pin', action='store_true', help="Pin each inference process to its own cores")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--scaling', help="Comma-separated worker counts for a throughput scaling report")
+    parser.add_argument('--scaling-images', type=int, default=512, help="Images used per scaling run")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.file_list:
+        parser.error("give at least one input directory/file or --file-list")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    paths = iter_image_paths(args.inputs, args.file_list)
+    options = dict(model_path=args.model, backend=args.backend, decoders=args.decoders, threads=args.threads,
+                   batch_size=args.batch_size, top_k=args.top_k, pin=args.pin)
+    if args.scaling:
+        sample = [path for _, path in zip(range(args.scaling_images), paths)]
+        scaling_report(sample, [int(w) for w in args.scaling.split(',')], **options)
+        return 0
+    if not args.output:
+        parser.error("--output is required unless --scaling is given")
+    scored, elapsed, load_time = score_parallel(paths, args.output, workers=args.workers, **options)
+    rate = scored / elapsed if elapsed else 0.0
+    print(f"Scored {scored} images in {elapsed:.1f}s ({rate:.1f} images/sec) with {args.workers} workers, "
+          f"after {load_time:.1f}s loading models")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
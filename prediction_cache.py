@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Define the cache limits; set PLANT_CACHE_DIR to spill evicted entries to disk
+CACHE_SIZE = int(os.environ.get('PLANT_CACHE_SIZE', '1024'))
+CACHE_DIR = os.environ.get('PLANT_CACHE_DIR') or None
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    # Bounded LRU of prediction vectors keyed by content hash, shared by all sessions
+
+    def __init__(self, max_entries=CACHE_SIZE, spill_dir=CACHE_DIR):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key + '.npy')
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            predictions = np.load(self._spill_path(key))
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            self.put(key, predictions)
+            return predictions
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, predictions):
+        evicted = []
+        with self._lock:
+            self._entries[key] = predictions
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        # Write evicted entries outside the lock so disk I/O never blocks readers
+        if self.spill_dir:
+            for evicted_key, evicted_predictions in evicted:
+                path = self._spill_path(evicted_key)
+                if not os.path.exists(path):
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        np.save(f, evicted_predictions)
+                    os.replace(tmp_path, path)
+
+    def get_or_compute(self, key, compute):
+        predictions = self.get(key)
+        if predictions is None:
+            predictions = compute()
+            self.put(key, predictions)
+        return predictions
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+# Process-wide cache shared across Streamlit sessions and other entry points
+default_cache = PredictionCache()
@@ -0,0 +1,347 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from dataset import TRAIN_DIR, VALID_DIR, IMAGE_EXTENSIONS, list_labeled_images
+from inference import BATCH_SIZE, class_labels, plant_labels, prepare_image
+from preprocessing import IMAGE_SIZE, normalize
+
+logger = logging.getLogger(__name__)
+
+# Define the cascade that screens images before the 19-way model: cheap colour
+# statistics first, then a tiny plant-type model when one has been trained.
+# Off by default; enable it once `prefilter.py report` has validated the
+# thresholds on real uploads.
+PREFILTER = os.environ.get('PLANT_PREFILTER', '0') == '1'
+PREFILTER_MODEL_PATH = os.environ.get('PLANT_PREFILTER_MODEL_PATH', 'prefilter_model.keras')
+# Both stages look at a box-filtered thumbnail of the decoded model input
+THUMBNAIL_FACTOR = 4
+THUMBNAIL_SIZE = (IMAGE_SIZE[0] // THUMBNAIL_FACTOR, IMAGE_SIZE[1] // THUMBNAIL_FACTOR)
+
+# Define the rejection thresholds
+MIN_LEAF_FRACTION = float(os.environ.get('PLANT_MIN_LEAF_FRACTION', '0.1'))
+MIN_CONTRAST = float(os.environ.get('PLANT_MIN_CONTRAST', '0.03'))
+MIN_BRIGHTNESS = float(os.environ.get('PLANT_MIN_BRIGHTNESS', '0.08'))
+MAX_BRIGHTNESS = float(os.environ.get('PLANT_MAX_BRIGHTNESS', '0.97'))
+MIN_PLANT_CONFIDENCE = float(os.environ.get('PLANT_MIN_PLANT_CONFIDENCE', '0.6'))
+
+# Leaf-coloured pixels: hue from yellow through green (30-170 degrees on PIL's
+# 0-255 scale), so yellowed and spotted leaves still count, and enough
+# saturation and value to exclude grey backgrounds and shadows
+LEAF_HUE = (21, 120)
+LEAF_MIN_SATURATION = 50
+LEAF_MIN_VALUE = 40
+
+# The plant-type model predicts the supported plants plus everything else
+PREFILTER_LABELS = plant_labels + ['Other']
+OTHER_INDEX = len(plant_labels)
+
+Decision = namedtuple('Decision', ['accepted', 'reason', 'plant', 'confidence'])
+
+
+def plant_of(label):
+    return next(plant for plant in plant_labels if label.startswith(plant))
+
+
+def thumbnail(pixels):
+    return Image.fromarray(pixels).reduce(THUMBNAIL_FACTOR)
+
+
+def image_stats(thumb):
+    hsv = np.asarray(thumb.convert('HSV'))
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    leaf = ((hue >= LEAF_HUE[0]) & (hue <= LEAF_HUE[1])
+            & (saturation >= LEAF_MIN_SATURATION) & (value >= LEAF_MIN_VALUE))
+    return {
+        'leaf_fraction': float(leaf.mean()),
+        'brightness': float(value.mean() / 255),
+        'contrast': float(value.std() / 255),
+    }
+
+
+# Pure decision rule, so reports can sweep thresholds without rescoring images
+def decide(stats, plant_probabilities=None, min_leaf_fraction=MIN_LEAF_FRACTION, min_contrast=MIN_CONTRAST,
+           min_plant_confidence=MIN_PLANT_CONFIDENCE):
+    if not MIN_BRIGHTNESS <= stats['brightness'] <= MAX_BRIGHTNESS:
+        return Decision(False, "too dark or overexposed", None, 0.0)
+    if stats['contrast'] < min_contrast:
+        return Decision(False, "blank or featureless image", None, 0.0)
+    if stats['leaf_fraction'] < min_leaf_fraction:
+        return Decision(False, "no leaf found", None, 0.0)
+    if plant_probabilities is None:
+        return Decision(True, None, None, 0.0)
+    index = int(np.argmax(plant_probabilities))
+    confidence = float(plant_probabilities[index])
+    if index == OTHER_INDEX or confidence < min_plant_confidence:
+        return Decision(False, "unsupported plant", None, confidence)
+    return Decision(True, None, plant_labels[index], confidence)
+
+
+class Cascade:
+    # Screens decoded (256, 256, 3) uint8 images; only accepted ones need the full model
+
+    def __init__(self, model=None, min_leaf_fraction=MIN_LEAF_FRACTION, min_contrast=MIN_CONTRAST,
+                 min_plant_confidence=MIN_PLANT_CONFIDENCE):
+        self.model = model
+        self.min_leaf_fraction = min_leaf_fraction
+        self.min_contrast = min_contrast
+        self.min_plant_confidence = min_plant_confidence
+
+    def score(self, images, min_leaf_fraction=None):
+        # Statistics for every image, plant-type probabilities for those that pass them.
+        # Reports pass their lowest leaf fraction so every threshold they sweep has probabilities.
+        if min_leaf_fraction is None:
+            min_leaf_fraction = self.min_leaf_fraction
+        thumbs = [thumbnail(pixels) for pixels in images]
+        stats = [image_stats(thumb) for thumb in thumbs]
+        probabilities = [None] * len(images)
+        if self.model is not None:
+            survivors = [i for i, s in enumerate(stats)
+                         if decide(s, None, min_leaf_fraction, self.min_contrast).accepted]
+            if survivors:
+                batch = normalize(np.stack([np.asarray(thumbs[i]) for i in survivors]))
+                for i, row in zip(survivors, np.asarray(self.model.predict_on_batch(batch))):
+                    probabilities[i] = row
+        return stats, probabilities
+
+    def check_batch(self, images):
+        with metrics.timed('prefilter'):
+            stats, probabilities = self.score(images)
+            decisions = [decide(s, p, self.min_leaf_fraction, self.min_contrast, self.min_plant_confidence)
+                         for s, p in zip(stats, probabilities)]
+        for decision in decisions:
+            if not decision.accepted:
+                metrics.registry.increment('plant_prefilter_rejected_total', reason=decision.reason)
+        return decisions
+
+    def check(self, pixels):
+        return self.check_batch([pixels])[0]
+
+
+def load_cascade(path=PREFILTER_MODEL_PATH, **thresholds):
+    if not path or not os.path.exists(path):
+        logger.info("No plant-type model at %s, pre-filtering on image statistics only", path)
+        return Cascade(None, **thresholds)
+    import tensorflow as tf
+    from inference_engine import compile_model
+    model = compile_model(tf.keras.models.load_model(path, compile=False), (1, BATCH_SIZE))
+    return Cascade(model, **thresholds)
+
+
+# About 9k parameters; a forward pass on a 64x64 thumbnail costs well under
+# a millisecond next to the full MobileNetV2 at 256x256
+def build_plant_model():
+    import tensorflow as tf
+    return tf.keras.models.Sequential([
+        tf.keras.Input(shape=THUMBNAIL_SIZE[::-1] + (3,)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, padding='same', activation='relu'),
+        tf.keras.layers.SeparableConv2D(32, 3, strides=2, padding='same', activation='relu'),
+        tf.keras.layers.SeparableConv2D(64, 3, strides=2, padding='same', activation='relu'),
+        tf.keras.layers.SeparableConv2D(64, 3, strides=2, padding='same', activation='relu'),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dropout(0.3),
+        tf.keras.layers.Dense(len(PREFILTER_LABELS), activation='softmax')
+    ])
+
+
+def list_other_images(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+# Disease class directories map to their plant, the other directory to 'Other'
+def plant_samples(leaf_dir, other_dir, per_class=None):
+    plant_index = [plant_labels.index(plant_of(label)) for label in class_labels]
+    samples = [(path, plant_index[label]) for path, label in list_labeled_images(leaf_dir, per_class)]
+    samples += [(path, OTHER_INDEX) for path in list_other_images(other_dir)]
+    return samples
+
+
+def build_plant_dataset(samples, batch_size, training, seed=0):
+    import tensorflow as tf
+    from train import augment, decode_and_resize
+    dataset = tf.data.Dataset.from_tensor_slices(([p for p, _ in samples], [label for _, label in samples]))
+    if training:
+        dataset = dataset.shuffle(len(samples), seed=seed, reshuffle_each_iteration=True)
+
+    # Decode at the model input size and box-filter down, as thumbnail() does at serving time
+    def to_thumbnail(path, label):
+        image, label = decode_and_resize(path, label)
+        image = tf.nn.avg_pool2d(tf.cast(image[tf.newaxis], tf.float32), THUMBNAIL_FACTOR, THUMBNAIL_FACTOR, 'VALID')
+        return tf.round(image[0]) / 255.0, tf.one_hot(label, len(PREFILTER_LABELS))
+
+    dataset = dataset.map(to_thumbnail, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
+    if training:
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def train_plant_model(train_dir, valid_dir, other_dir, valid_other_dir=None, epochs=20, batch_size=128,
+                      per_class=None, seed=42):
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    train_samples = plant_samples(train_dir, other_dir, per_class)
+    counts = np.bincount([label for _, label in train_samples], minlength=len(PREFILTER_LABELS))
+    # Weight classes inversely to their frequency; 'Other' sets are usually small
+    class_weight = {i: len(train_samples) / (len(counts) * max(c, 1)) for i, c in enumerate(counts)}
+    validation = None
+    if valid_other_dir:
+        validation = build_plant_dataset(plant_samples(valid_dir, valid_other_dir), batch_size, False)
+
+    model = build_plant_model()
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    monitor = 'val_loss' if validation is not None else 'loss'
+    model.fit(build_plant_dataset(train_samples, batch_size, True, seed), epochs=epochs,
+              validation_data=validation, class_weight=class_weight,
+              callbacks=[tf.keras.callbacks.EarlyStopping(monitor=monitor, patience=4, restore_best_weights=True)])
+    return model
+
+
+# Score a mixed set of supported leaves and other images once, then report each
+# leaf fraction threshold: wrong rejections, wrong acceptances and the share of
+# full-model compute the cascade saves
+def report(cascade, full_model, samples, leaf_fractions, runs=20, packed=None):
+    # Samples are (source, supported) pairs; with packed, integer sources are
+    # records read from its shards instead of image files to decode
+    from inference_engine import time_calls
+
+    def load(source):
+        if packed is not None and not isinstance(source, str):
+            return packed[source][0]
+        return prepare_image(source)
+
+    lowest = min(leaf_fractions)
+    stats, probabilities, stats_seconds = [], [], []
+    for source, _ in samples:
+        pixels = load(source)
+        start = time.perf_counter()
+        image_stats(thumbnail(pixels))
+        stats_seconds.append(time.perf_counter() - start)
+        s, p = cascade.score([pixels], lowest)
+        stats.append(s[0])
+        probabilities.append(p[0])
+
+    pixels = load(samples[0][0])
+    full_ms = time_calls(full_model.predict_on_batch, normalize(pixels)[np.newaxis], runs)
+    stats_ms = float(np.mean(stats_seconds) * 1000)
+    plant_ms = 0.0
+    if cascade.model is not None:
+        thumb = normalize(np.asarray(thumbnail(pixels)))[np.newaxis]
+        plant_ms = time_calls(cascade.model.predict_on_batch, thumb, runs)
+    supported = np.array([expected for _, expected in samples])
+
+    rows = []
+    for fraction in leaf_fractions:
+        # The plant-type model only runs on images that pass the statistics
+        screened = np.array([decide(s, None, fraction, cascade.min_contrast).accepted for s in stats])
+        accepted = np.array([decide(s, p, fraction, cascade.min_contrast, cascade.min_plant_confidence).accepted
+                             for s, p in zip(stats, probabilities)])
+        # Without the cascade every image runs the full model
+        baseline = len(samples) * full_ms
+        cost = len(samples) * stats_ms + screened.sum() * plant_ms + accepted.sum() * full_ms
+        rows.append({
+            'min_leaf_fraction': fraction,
+            'accepted': int(accepted.sum()),
+            'rejected': int((~accepted).sum()),
+            'false_rejections': int((supported & ~accepted).sum()),
+            'false_acceptances': int((~supported & accepted).sum()),
+            'compute_saved': float(1 - cost / baseline) if baseline else 0.0,
+        })
+    return {'images': len(samples), 'supported': int(supported.sum()), 'stats_ms': stats_ms,
+            'plant_model_ms': plant_ms, 'full_model_ms': full_ms, 'plant_model': cascade.model is not None,
+            'thresholds': rows}
+
+
+def print_report(result):
+    print(f"{result['images']} images ({result['supported']} supported leaves); statistics {result['stats_ms']:.2f}ms, "
+          f"plant-type model {result['plant_model_ms']:.2f}ms, full model {result['full_model_ms']:.2f}ms per image; "
+          f"plant-type model: {'yes' if result['plant_model'] else 'no'}")
+    print(f"{'leaf fraction':>14}{'accepted':>10}{'rejected':>10}{'false rej.':>12}{'false acc.':>12}{'saved':>8}")
+    for row in result['thresholds']:
+        print(f"{row['min_leaf_fraction']:>14.2f}{row['accepted']:>10}{row['rejected']:>10}"
+              f"{row['false_rejections']:>12}{row['false_acceptances']:>12}{row['compute_saved'] * 100:>7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen out non-leaf and unsupported images before the full model.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    check_parser = subparsers.add_parser('check', help="Show the cascade's decision for images")
+    check_parser.add_argument('images', nargs='+')
+
+    train_parser = subparsers.add_parser('train', help="Train the tiny plant-type model")
+    train_parser.add_argument('--other-dir', required=True, help="Images of anything that is not a supported leaf")
+    train_parser.add_argument('--valid-other-dir', help="Held-out unsupported images for validation")
+    train_parser.add_argument('--train-dir', default=TRAIN_DIR)
+    train_parser.add_argument('--valid-dir', default=VALID_DIR)
+    train_parser.add_argument('--per-class', type=int, help="Cap images per disease class")
+    train_parser.add_argument('--epochs', type=int, default=20)
+    train_parser.add_argument('--batch-size', type=int, default=128)
+    train_parser.add_argument('--output', default=PREFILTER_MODEL_PATH)
+
+    report_parser = subparsers.add_parser('report', help="Report compute saved on a mixed test set")
+    report_parser.add_argument('--other-dir', required=True, help="Unsupported images in the test set")
+    report_parser.add_argument('--leaf-dir', default=VALID_DIR, help="Supported leaves in the test set")
+    report_parser.add_argument('--per-class', type=int, default=50)
+    report_parser.add_argument('--packed-dir', help="Read the leaves from shards.py shards (<dir>/<leaf dir name>) instead of JPEGs")
+    report_parser.add_argument('--leaf-fractions', default='0.02,0.05,0.1,0.15,0.2,0.3')
+    report_parser.add_argument('--output', help="Also write the report as JSON")
+
+    for command in (check_parser, report_parser):
+        command.add_argument('--model', default=PREFILTER_MODEL_PATH, help="Plant-type model ('' for statistics only)")
+        command.add_argument('--min-leaf-fraction', type=float, default=MIN_LEAF_FRACTION)
+        command.add_argument('--min-contrast', type=float, default=MIN_CONTRAST)
+        command.add_argument('--min-plant-confidence', type=float, default=MIN_PLANT_CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.command == 'train':
+        model = train_plant_model(args.train_dir, args.valid_dir, args.other_dir, args.valid_other_dir,
+                                  args.epochs, args.batch_size, args.per_class)
+        model.save(args.output)
+        print("Saved", args.output, f"({model.count_params():,} parameters)")
+        return
+
+    cascade = load_cascade(args.model, min_leaf_fraction=args.min_leaf_fraction, min_contrast=args.min_contrast,
+                           min_plant_confidence=args.min_plant_confidence)
+    if args.command == 'check':
+        for path in args.images:
+            decision = cascade.check(prepare_image(path))
+            if decision.accepted:
+                print(f"{path}: accepted" + (f" ({decision.plant}, {decision.confidence * 100:.1f}%)"
+                                             if decision.plant else ""))
+            else:
+                print(f"{path}: rejected, {decision.reason}")
+        return
+
+    import model_registry
+    packed = None
+    if args.packed_dir:
+        from shards import PackedDataset, packed_path, sample_records
+        packed = PackedDataset(packed_path(args.packed_dir, args.leaf_dir))
+        samples = [(int(record), True) for record in sample_records(packed, args.per_class)]
+    else:
+        samples = [(path, True) for path, _ in list_labeled_images(args.leaf_dir, per_class=args.per_class)]
+    # Unsupported images are not in class directories, so they are always decoded
+    samples += [(path, False) for path in list_other_images(args.other_dir)]
+    result = report(cascade, model_registry.get_model(), samples,
+                    [float(f) for f in args.leaf_fractions.split(',') if f], packed=packed)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+IMAGE_SIZE = (256, 256)
+SCALE = np.float32(1.0 / 255.0)
+
+
+# Decode an image straight to the model input size. JPEGs are decoded by libjpeg
+# at the smallest 1/2, 1/4 or 1/8 scale that still covers the target size, so a
+# 12 megapixel photo never materializes at full resolution.
+def decode_image(source, size=IMAGE_SIZE):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    if img.format == 'JPEG':
+        img.draft('RGB', size)
+
+    # Apply the EXIF orientation so phone photos are upright
+    img = ImageOps.exif_transpose(img)
+
+    # Composite transparent images on white instead of exposing hidden pixel colors
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return img
+
+
+# Decode an image to a (height, width, 3) uint8 array, optionally into a preallocated slot
+def decode_to_array(source, out=None, size=IMAGE_SIZE):
+    pixels = np.asarray(decode_image(source, size), dtype=np.uint8)
+    if out is None:
+        return pixels
+    out[...] = pixels
+    return out
+
+
+# Scale uint8 pixels to [0, 1] float32 in a single pass, writing into `out` when given
+def normalize(pixels, out=None):
+    return np.multiply(pixels, SCALE, out=out, dtype=np.float32)
+
+
+_local = threading.local()
+
+
+# Per-thread float32 batch buffer, so repeated batches of the same shape reuse memory
+def batch_input_buffer(shape):
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    if shape not in buffers:
+        buffers[shape] = np.zeros(shape, dtype=np.float32)
+    return buffers[shape]
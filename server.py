@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web
+
+import metrics
+import model_registry
+from inference import DECODE_WORKERS, class_labels, predict_batch, prepare_image
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MicroBatcher:
+    # Collect concurrent requests into micro-batches of up to max_batch images,
+    # waiting at most max_wait for a batch to fill and never so long that the
+    # oldest request would overrun the latency budget
+
+    def __init__(self, model, max_batch=16, max_wait=0.005, workers=1, queue_size=256, latency_budget=0.25):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        self.latency_budget = latency_budget
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.forward_time = 0.0
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, img):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((time.perf_counter(), img, future))
+        except asyncio.QueueFull:
+            raise QueueFull()
+        return await future
+
+    def _deadline(self, first_enqueued):
+        # Stop waiting for more requests once the oldest one has no slack left
+        budget_deadline = first_enqueued + self.latency_budget - self.forward_time
+        return min(time.perf_counter() + self.max_wait, budget_deadline)
+
+    def _drain(self, batch):
+        # Requests already queued ride along for free: the forward pass is padded
+        # to max_batch anyway, so the budget never keeps them out of the batch
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            self._drain(batch)
+            # The latency budget only limits how long we wait for more requests
+            deadline = self._deadline(batch[0][0])
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                self._drain(batch)
+
+            # Drop requests whose callers already gave up
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(
+                    self.executor, predict_batch, self.model, [img for _, img, _ in batch], self.max_batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            # Track a moving average of forward-pass time for the latency budget
+            elapsed = finished - start
+            self.forward_time = elapsed if not self.forward_time else 0.9 * self.forward_time + 0.1 * elapsed
+            self.batch_sizes.append(len(batch))
+            metrics.registry.histogram('plant_batch_size', BATCH_SIZE_BUCKETS).observe(len(batch))
+            for (enqueued, _, future), prediction in zip(batch, predictions):
+                metrics.observe_stage('queue_wait', start - enqueued)
+                self.latencies.append(finished - enqueued)
+                if not future.done():
+                    future.set_result(prediction)
+
+    def stats(self):
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            'queued': self.queue.qsize(),
+            'batches': len(self.batch_sizes),
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'forward_ms': self.forward_time * 1000,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'latency_budget_ms': self.latency_budget * 1000,
+        }
+
+
+async def read_image_bytes(request):
+    if request.content_type.startswith('multipart/'):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                return await part.read()
+        return b''
+    return await request.read()
+
+
+def parse_top_k(query, default=3):
+    try:
+        top_k = int(query.get('top_k', default))
+    except ValueError:
+        top_k = 0
+    if not 1 <= top_k <= len(class_labels):
+        raise web.HTTPBadRequest(text=f"top_k must be an integer between 1 and {len(class_labels)}")
+    return top_k
+
+
+async def predict(request):
+    start = time.perf_counter()
+    app = request.app
+    top_k = parse_top_k(request.query)
+    data = await read_image_bytes(request)
+    if not data:
+        raise web.HTTPBadRequest(text="Request body must contain an image")
+    loop = asyncio.get_running_loop()
+    try:
+        img = await loop.run_in_executor(app['decode_pool'], prepare_image, data)
+    except (OSError, ValueError):
+        raise web.HTTPBadRequest(text="Could not decode image")
+
+    try:
+        prediction = await asyncio.wait_for(app['batcher'].submit(img), app['request_timeout'])
+    except QueueFull:
+        raise web.HTTPServiceUnavailable(text="Server busy", headers={'Retry-After': '1'})
+    except asyncio.TimeoutError:
+        raise web.HTTPGatewayTimeout(text="Prediction timed out")
+
+    indices = np.argsort(prediction)[::-1][:top_k]
+    predicted_class = class_labels[indices[0]]
+    result = {
+        'predicted_class': predicted_class,
+        'confidence': float(prediction[indices[0]]),
+        'top_k': [{'label': class_labels[i], 'confidence': float(prediction[i])} for i in indices],
+    }
+    if request.query.get('info'):
+        from class_info import class_info
+        result['info'] = class_info.get(predicted_class, {})
+    metrics.observe_stage('request', time.perf_counter() - start)
+    return web.json_response(result)
+
+
+async def labels(request):
+    return web.json_response(class_labels)
+
+
+async def health(request):
+    return web.json_response({'status': 'ok'})
+
+
+async def stats(request):
+    return web.json_response(request.app['batcher'].stats())
+
+
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.registry.render_prometheus(), content_type='text/plain')
+
+
+def create_app(model, max_batch=16, max_wait=0.005, workers=1, queue_size=256,
+               latency_budget=0.25, request_timeout=5.0, decode_workers=DECODE_WORKERS):
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app['request_timeout'] = request_timeout
+    app['decode_pool'] = ThreadPoolExecutor(max_workers=decode_workers)
+
+    async def on_startup(app):
+        app['batcher'] = MicroBatcher(model, max_batch, max_wait, workers, queue_size, latency_budget)
+        app['batcher'].start()
+
+    async def on_cleanup(app):
+        await app['batcher'].stop()
+        app['decode_pool'].shutdown(wait=False)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post('/predict', predict)
+    app.router.add_get('/labels', labels)
+    app.router.add_get('/health', health)
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/metrics', prometheus_metrics)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP inference server with dynamic micro-batching.")
+    parser.add_argument('--host', default=os.environ.get('PLANT_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PLANT_PORT', '8080')))
+    parser.add_argument('--max-batch', type=int, default=16, help="Largest micro-batch per forward pass")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="Longest wait for a micro-batch to fill")
+    parser.add_argument('--workers', type=int, default=1, help="Concurrent forward passes")
+    parser.add_argument('--queue-size', type=int, default=256, help="Queued requests before rejecting with 503")
+    parser.add_argument('--latency-budget-ms', type=float, default=250.0, help="Target queueing plus inference latency")
+    parser.add_argument('--timeout', type=float, default=5.0, help="Per-request timeout in seconds")
+    parser.add_argument('--decode-workers', type=int, default=DECODE_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    model = model_registry.get_model()
+    if hasattr(model, 'warmup'):
+        # predict_batch pads every micro-batch to --max-batch
+        model.warmup((args.max_batch,))
+    app = create_app(model, args.max_batch, args.max_wait_ms / 1000, args.workers, args.queue_size,
+                     args.latency_budget_ms / 1000, args.timeout, args.decode_workers)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from corrections import CORRECTIONS_DIR, PIXEL_SHAPE, RECORD_BYTES, CorrectionStore
+from dataset import TRAIN_DIR, VALID_DIR, list_classes, list_labeled_images
+from inference import DECODE_WORKERS, class_labels
+from preprocessing import IMAGE_SIZE, decode_to_array
+
+logger = logging.getLogger(__name__)
+
+# Define where packed datasets live and how many images go in one shard file
+# (2048 images of 256x256x3 are about 400MB)
+PACKED_DIR = os.environ.get('PLANT_PACKED_DIR', 'packed')
+SHARD_RECORDS = int(os.environ.get('PLANT_SHARD_RECORDS', '2048'))
+PACK_BATCH = 256
+
+# One index entry per image: the shard file, the byte offset of its pixels and
+# its class_labels index. Entries are fixed size, so the index is memory-mapped
+# and labels can be rewritten in place when a correction changes one.
+INDEX_DTYPE = np.dtype([('shard', '<u4'), ('offset', '<u8'), ('label', '<u2')])
+
+
+class PackedDataset:
+    # A directory of shard_NNNNN.u8 files holding model-input-size uint8 images
+    # back to back, an index.bin of INDEX_DTYPE entries and a sources.jsonl line
+    # per image recording where it came from. Appending writes pixels before the
+    # index entry, so an interrupted append never indexes a partial image.
+
+    def __init__(self, directory, shard_records=SHARD_RECORDS):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.bin')
+        self.sources_path = os.path.join(directory, 'sources.jsonl')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self._lock = threading.Lock()
+        self._shards = {}
+        self._index = None
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+            self._validate()
+        else:
+            self.meta = {'classes': class_labels, 'image_shape': list(PIXEL_SHAPE), 'shard_records': shard_records}
+            with open(self.meta_path, 'w') as f:
+                json.dump(self.meta, f, indent=2)
+
+    def _validate(self):
+        if self.meta['classes'] != class_labels:
+            raise ValueError(f"{self.directory} was packed with different classes than class_labels")
+        if tuple(self.meta['image_shape']) != PIXEL_SHAPE:
+            raise ValueError(f"{self.directory} holds {self.meta['image_shape']} images, expected {PIXEL_SHAPE}")
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, f'shard_{shard:05d}.u8')
+
+    @property
+    def index(self):
+        # Re-mapped after every append; readers get a zero-copy view of the file
+        if self._index is None:
+            count = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize if os.path.exists(self.index_path) else 0
+            if count:
+                self._index = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+            else:
+                self._index = np.empty(0, dtype=INDEX_DTYPE)
+        return self._index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def labels(self):
+        return np.asarray(self.index['label'], dtype=np.int64)
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(self.shard_path(shard), dtype=np.uint8, mode='r')
+        return self._shards[shard]
+
+    def __getitem__(self, record):
+        # A read-only view straight into the shard file, no copy and no decode
+        entry = self.index[record]
+        pixels = self._shard(int(entry['shard']))[int(entry['offset']):int(entry['offset']) + RECORD_BYTES]
+        return pixels.reshape(PIXEL_SHAPE), int(entry['label'])
+
+    def take(self, records, out=None):
+        # Gather records into one (n, 256, 256, 3) batch; this is the only copy
+        entries = self.index[np.asarray(records)]
+        if out is None:
+            out = np.empty((len(entries),) + PIXEL_SHAPE, dtype=np.uint8)
+        for i, (shard, offset) in enumerate(zip(entries['shard'], entries['offset'])):
+            out[i] = self._shard(int(shard))[int(offset):int(offset) + RECORD_BYTES].reshape(PIXEL_SHAPE)
+        return out[:len(entries)], np.asarray(entries['label'], dtype=np.int64)
+
+    def iter_batches(self, batch_size, shuffle=False, seed=0, records=None):
+        records = np.arange(len(self)) if records is None else np.asarray(records)
+        if shuffle:
+            records = np.random.default_rng(seed).permutation(records)
+        for start in range(0, len(records), batch_size):
+            # Read each batch in file order; its order within the batch does not matter
+            yield self.take(np.sort(records[start:start + batch_size]))
+
+    def sources(self):
+        # Source of every record, in record order; later lines override earlier ones
+        sources = {}
+        if os.path.exists(self.sources_path):
+            with open(self.sources_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    sources[entry['source']] = entry
+        return sources
+
+    def _tail_shard(self):
+        # Shard the next image goes into
+        if not len(self):
+            return 0
+        shard = int(self.index['shard'][-1])
+        if os.path.getsize(self.shard_path(shard)) // RECORD_BYTES >= self.meta['shard_records']:
+            return shard + 1
+        return shard
+
+    def append(self, images, labels, sources):
+        # Append a batch of (256, 256, 3) uint8 images with their label indices and sources
+        with self._lock:
+            entries = np.empty(len(images), dtype=INDEX_DTYPE)
+            shard = self._tail_shard()
+            handle = None
+            offset = 0
+            try:
+                for i, (pixels, label) in enumerate(zip(images, labels)):
+                    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+                    if pixels.shape != PIXEL_SHAPE:
+                        raise ValueError(f"Expected pixels of shape {PIXEL_SHAPE}, got {pixels.shape}")
+                    if handle is not None and offset // RECORD_BYTES >= self.meta['shard_records']:
+                        handle.close()
+                        handle = None
+                        shard += 1
+                    if handle is None:
+                        handle = open(self.shard_path(shard), 'ab')
+                        # Skip bytes left by an append that was interrupted before indexing them
+                        offset = handle.tell()
+                    handle.write(pixels.tobytes())
+                    entries[i] = (shard, offset, label)
+                    offset += RECORD_BYTES
+            finally:
+                if handle is not None:
+                    handle.close()
+            start = len(self)
+            with open(self.index_path, 'ab') as f:
+                f.write(entries.tobytes())
+            with open(self.sources_path, 'a') as f:
+                for record, (source, label) in enumerate(zip(sources, labels), start):
+                    f.write(json.dumps({'source': source, 'record': record, 'label': class_labels[label]}) + '\n')
+            # Shards grew, so drop their maps along with the index
+            self._index = None
+            self._shards.clear()
+        return start
+
+    def relabel(self, record, label, source):
+        with self._lock:
+            index = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r+', shape=(len(self),))
+            index['label'][record] = label
+            index.flush()
+            del index
+            with open(self.sources_path, 'a') as f:
+                f.write(json.dumps({'source': source, 'record': record, 'label': class_labels[label]}) + '\n')
+            self._index = None
+
+    def class_counts(self):
+        return np.bincount(self.labels, minlength=len(class_labels))
+
+    def to_tf_dataset(self, batch_size, training, seed=0):
+        # Batches of float [0, 1] images and one-hot labels, like train.build_dataset.
+        # Training reshuffles every epoch with a new seed; nothing is decoded.
+        import tensorflow as tf
+        from train import augment
+        epochs = iter(range(sys.maxsize))
+
+        def batches():
+            yield from self.iter_batches(batch_size, shuffle=training, seed=seed + next(epochs))
+
+        dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+            tf.TensorSpec((None,) + PIXEL_SHAPE, tf.uint8), tf.TensorSpec((None,), tf.int64)))
+
+        def to_inputs(images, labels):
+            return tf.cast(images, tf.float32) / 255.0, tf.one_hot(labels, len(class_labels))
+
+        dataset = dataset.map(to_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+        if training:
+            dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+# Packed copy of a Train/Valid style directory, as written by `shards.py pack`
+def packed_path(packed_dir, source_dir):
+    return os.path.join(packed_dir, os.path.basename(os.path.normpath(source_dir)))
+
+
+# Records of a packed dataset, at most per_class of each class, in file order
+def sample_records(packed, per_class=None, seed=0):
+    if per_class is None:
+        return np.arange(len(packed))
+    rng = np.random.default_rng(seed)
+    labels = packed.labels
+    records = [rng.permutation(np.flatnonzero(labels == label))[:per_class] for label in range(len(class_labels))]
+    return np.sort(np.concatenate(records))
+
+
+def _decode(path):
+    try:
+        return decode_to_array(path, size=IMAGE_SIZE)
+    except (OSError, ValueError) as e:
+        logger.warning("Skipping %s: %s", path, e)
+        return None
+
+
+# Pack a Train/Valid style directory; images already packed are skipped, so
+# re-running after new images are added only decodes the new ones
+def pack_directory(source_dir, packed, workers=DECODE_WORKERS):
+    classes = list_classes(source_dir)
+    if len(classes) != len(class_labels):
+        raise ValueError(f"{source_dir} has {len(classes)} class directories, expected {len(class_labels)}")
+    packed_sources = packed.sources()
+    samples = [(path, label) for path, label in list_labeled_images(source_dir)
+               if os.path.abspath(path) not in packed_sources]
+    added = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(samples), PACK_BATCH):
+            batch = samples[start:start + PACK_BATCH]
+            images = list(pool.map(_decode, [path for path, _ in batch]))
+            kept = [(os.path.abspath(path), label, img) for (path, label), img in zip(batch, images) if img is not None]
+            if kept:
+                packed.append([img for _, _, img in kept], [label for _, label, _ in kept],
+                              [path for path, _, _ in kept])
+                added += len(kept)
+            logger.info("Packed %d of %d new images", added, len(samples))
+    return added
+
+
+# Add user corrections, which are stored pre-resized already. An image corrected
+# again is relabelled in place rather than packed twice.
+def add_corrections(packed, store):
+    packed_sources = packed.sources()
+    pixels = store.pixels()
+    added = relabelled = 0
+    new = []
+    for entry in store.entries():
+        source = f"correction:{entry['hash']}"
+        label = class_labels.index(entry['corrected'])
+        if source in packed_sources:
+            if packed_sources[source]['label'] != entry['corrected']:
+                packed.relabel(packed_sources[source]['record'], label, source)
+                relabelled += 1
+            continue
+        new.append((source, label, entry['record']))
+    for start in range(0, len(new), PACK_BATCH):
+        batch = new[start:start + PACK_BATCH]
+        packed.append([pixels[record] for _, _, record in batch], [label for _, label, _ in batch],
+                      [source for source, _, _ in batch])
+        added += len(batch)
+    return added, relabelled
+
+
+def read_throughput(packed, batch_size=64, limit=4096, seed=0):
+    records = np.random.default_rng(seed).permutation(len(packed))[:limit]
+    start = time.perf_counter()
+    count = 0
+    for images, _ in packed.iter_batches(batch_size, records=records):
+        count += len(images)
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack image directories into pre-resized uint8 shards.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack', help="Pack (or append new images from) Train/Valid directories")
+    pack_parser.add_argument('sources', nargs='*', default=[TRAIN_DIR, VALID_DIR])
+    pack_parser.add_argument('--output-dir', default=PACKED_DIR, help="Each source goes to a subdirectory named after it")
+    pack_parser.add_argument('--workers', type=int, default=DECODE_WORKERS)
+
+    corrections_parser = subparsers.add_parser('add-corrections', help="Append user corrections to a packed dataset")
+    corrections_parser.add_argument('packed', nargs='?', default=os.path.join(PACKED_DIR, os.path.basename(TRAIN_DIR)))
+    corrections_parser.add_argument('--corrections-dir', default=CORRECTIONS_DIR)
+
+    info_parser = subparsers.add_parser('info', help="Show class counts and random-read throughput")
+    info_parser.add_argument('packed')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.command == 'pack':
+        for source in args.sources:
+            packed = PackedDataset(os.path.join(args.output_dir, os.path.basename(os.path.normpath(source))))
+            start = time.perf_counter()
+            added = pack_directory(source, packed, args.workers)
+            print(f"{packed.directory}: added {added} images in {time.perf_counter() - start:.1f}s, {len(packed)} total")
+    elif args.command == 'add-corrections':
+        packed = PackedDataset(args.packed)
+        added, relabelled = add_corrections(packed, CorrectionStore(args.corrections_dir))
+        print(f"{packed.directory}: added {added} corrections, relabelled {relabelled}, {len(packed)} total")
+    else:
+        packed = PackedDataset(args.packed)
+        for label, count in zip(class_labels, packed.class_counts()):
+            print(f"{label:<32}{count:>8}")
+        shards = len(set(packed.index['shard'].tolist()))
+        print(f"{len(packed)} images in {shards} shards; "
+              f"{read_throughput(packed):.0f} images/sec shuffled random reads")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from aiohttp import web
+
+from inference import class_labels
+from server import MicroBatcher, parse_top_k
+
+
+class SlowModel:
+    # 20ms per forward pass plus 2ms per image, like a small CPU model
+
+    def predict_on_batch(self, batch):
+        time.sleep(0.02 + 0.002 * len(batch))
+        return np.full((len(batch), len(class_labels)), 1.0 / len(class_labels), dtype=np.float32)
+
+
+def test_burst_is_batched_within_default_budget():
+    async def burst():
+        batcher = MicroBatcher(SlowModel(), max_batch=16, queue_size=512)
+        batcher.start()
+        img = np.zeros((256, 256, 3), dtype=np.uint8)
+        try:
+            await asyncio.gather(*(batcher.submit(img) for _ in range(400)))
+            return batcher.stats()
+        finally:
+            await batcher.stop()
+
+    stats = asyncio.run(burst())
+    # Before the fix a missed budget collapsed every batch to one real image
+    assert stats['mean_batch_size'] >= 12
+
+
+def test_top_k_must_be_a_valid_count():
+    assert parse_top_k({}) == 3
+    assert parse_top_k({'top_k': str(len(class_labels))}) == len(class_labels)
+    for value in ('abc', '0', '-1', str(len(class_labels) + 1)):
+        with pytest.raises(web.HTTPBadRequest):
+            parse_top_k({'top_k': value})
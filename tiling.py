@@ -0,0 +1,187 @@
+import argparse
+import io
+import logging
+import math
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import metrics
+from inference import BATCH_SIZE, class_labels, healthy_labels, predict_batch
+from preprocessing import IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Define the tiling defaults: model-size tiles overlapping by a quarter
+TILE_SIZE = int(os.environ.get('PLANT_TILE_SIZE', '256'))
+TILE_STRIDE = int(os.environ.get('PLANT_TILE_STRIDE', '192'))
+# A disease must reach TILE_THRESHOLD confidence on at least MIN_TILE_FRACTION
+# of the tiles (and never fewer than MIN_TILES) to win the verdict, so a few
+# misclassified soil or background tiles in a large image do not report a disease
+TILE_THRESHOLD = 0.5
+MIN_TILES = 2
+MIN_TILE_FRACTION = float(os.environ.get('PLANT_TILE_MIN_FRACTION', '0.05'))
+
+HEALTHY_INDICES = [class_labels.index(label) for label in healthy_labels]
+
+
+def open_full_resolution(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    img = ImageOps.exif_transpose(Image.open(source))
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def tile_positions(length, tile, stride):
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile + 1, stride))
+    if positions[-1] != length - tile:
+        positions.append(length - tile)
+    return positions
+
+
+def check_tiling(tile, stride):
+    # A stride larger than the tile would leave unscored gaps between tiles
+    if tile <= 0 or not 0 < stride <= tile:
+        raise ValueError(f"Tile stride must be between 1 and the tile size {tile}, got {stride}")
+
+
+# Yield (x, y, uint8 tile) for overlapping tiles covering the whole image.
+# Tiles are cropped lazily, so only one batch of them is ever held in memory.
+def iter_tiles(img, tile=TILE_SIZE, stride=TILE_STRIDE):
+    check_tiling(tile, stride)
+    width, height = img.size
+    for y in tile_positions(height, tile, stride):
+        for x in tile_positions(width, tile, stride):
+            crop = img.crop((x, y, x + tile, y + tile))
+            if crop.size != IMAGE_SIZE:
+                crop = crop.resize(IMAGE_SIZE, Image.Resampling.BICUBIC)
+            yield x, y, np.asarray(crop, dtype=np.uint8)
+
+
+class TileResult:
+    # Per-image verdict, per-class tile statistics and a coarse disease heatmap
+
+    def __init__(self, img_size, tile, cell):
+        width, height = img_size
+        self.tile = tile
+        self.cell = cell
+        grid = (max(1, -(-height // cell)), max(1, -(-width // cell)))
+        self.heat = np.zeros(grid, dtype=np.float32)
+        self.coverage = np.zeros(grid, dtype=np.float32)
+        self.probability_sum = np.zeros(len(class_labels), dtype=np.float64)
+        self.max_probability = np.zeros(len(class_labels), dtype=np.float32)
+        self.confident_tiles = np.zeros(len(class_labels), dtype=np.int64)
+        self.tiles = 0
+        self.seconds = 0.0
+
+    def add(self, positions, predictions):
+        disease = 1.0 - predictions[:, HEALTHY_INDICES].sum(axis=1)
+        for (x, y), score in zip(positions, disease):
+            rows = slice(y // self.cell, -(-(y + self.tile) // self.cell))
+            cols = slice(x // self.cell, -(-(x + self.tile) // self.cell))
+            self.heat[rows, cols] += score
+            self.coverage[rows, cols] += 1
+        self.probability_sum += predictions.sum(axis=0)
+        np.maximum(self.max_probability, predictions.max(axis=0), out=self.max_probability)
+        top = predictions.argmax(axis=1)
+        confident = predictions[np.arange(len(predictions)), top] >= TILE_THRESHOLD
+        np.add.at(self.confident_tiles, top[confident], 1)
+        self.tiles += len(predictions)
+
+    @property
+    def heatmap(self):
+        return self.heat / np.maximum(self.coverage, 1)
+
+    @property
+    def mean_probability(self):
+        return self.probability_sum / max(self.tiles, 1)
+
+    @property
+    def tiles_per_second(self):
+        return self.tiles / self.seconds if self.seconds else 0.0
+
+    def required_tiles(self, min_fraction=MIN_TILE_FRACTION):
+        return min(max(MIN_TILES, math.ceil(min_fraction * self.tiles)), self.tiles)
+
+    def verdict(self, min_fraction=MIN_TILE_FRACTION):
+        # Report the disease found confidently on the most tiles; a lesion on a
+        # few tiles should not be averaged away by healthy leaf and background.
+        # Returns the label, its confidence and the number of confident tiles behind it.
+        diseased = [i for i in range(len(class_labels)) if i not in HEALTHY_INDICES]
+        best = max(diseased, key=lambda i: (self.confident_tiles[i], self.max_probability[i]))
+        if self.confident_tiles[best] >= self.required_tiles(min_fraction):
+            return class_labels[best], float(self.max_probability[best]), int(self.confident_tiles[best])
+        index = int(np.argmax(self.mean_probability))
+        return class_labels[index], float(self.mean_probability[index]), int(self.confident_tiles[index])
+
+
+# Tiles are not recorded in the prediction metrics one by one, so a drone image
+# adds only its verdict (at min_fraction) to the class and confidence drift metrics
+def predict_tiled(model, img, tile=TILE_SIZE, stride=TILE_STRIDE, batch_size=BATCH_SIZE,
+                  min_fraction=MIN_TILE_FRACTION):
+    check_tiling(tile, stride)
+    result = TileResult(img.size, tile, max(1, stride // 4))
+    start = time.perf_counter()
+    positions, images = [], []
+    for x, y, pixels in iter_tiles(img, tile, stride):
+        positions.append((x, y))
+        images.append(pixels)
+        if len(images) == batch_size:
+            result.add(positions, predict_batch(model, images, batch_size, record=False))
+            positions, images = [], []
+    if images:
+        result.add(positions, predict_batch(model, images, batch_size, record=False))
+    result.seconds = time.perf_counter() - start
+    metrics.observe_stage('tiled_image', result.seconds)
+    label, confidence, _ = result.verdict(min_fraction)
+    metrics.record_predictions([label], [confidence])
+    return result
+
+
+# Blend the disease heatmap in red over a preview of the image
+def render_overlay(img, heatmap, max_size=1024, alpha=0.5):
+    preview = img.copy()
+    preview.thumbnail((max_size, max_size))
+    heat = Image.fromarray(np.uint8(np.clip(heatmap, 0, 1) * 255)).resize(preview.size, Image.Resampling.BILINEAR)
+    red = Image.new('RGB', preview.size, (255, 0, 0))
+    mask = heat.point(lambda value: int(value * alpha))
+    return Image.composite(red, preview, mask)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiled inference for high-resolution field and drone images.")
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--tile', type=int, default=TILE_SIZE)
+    parser.add_argument('--stride', type=int, default=TILE_STRIDE)
+    parser.add_argument('--min-tile-fraction', type=float, default=MIN_TILE_FRACTION,
+                        help="Share of tiles a disease must be confident on to be reported")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--overlay-dir', help="Write a heatmap overlay PNG per image here")
+    args = parser.parse_args(argv)
+    try:
+        check_tiling(args.tile, args.stride)
+    except ValueError as e:
+        parser.error(str(e))
+
+    import model_registry
+    logging.basicConfig(level=logging.INFO)
+    model = model_registry.get_model()
+    for path in args.images:
+        img = open_full_resolution(path)
+        result = predict_tiled(model, img, args.tile, args.stride, args.batch_size, args.min_tile_fraction)
+        label, confidence, supporting = result.verdict(args.min_tile_fraction)
+        print(f"{path}: {label} ({confidence * 100:.1f}%, confident on {supporting} of {result.tiles} tiles), "
+              f"{result.tiles} tiles in {result.seconds:.2f}s "
+              f"({result.tiles_per_second:.1f} tiles/sec)")
+        if args.overlay_dir:
+            os.makedirs(args.overlay_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(path))[0] + '_heatmap.png'
+            render_overlay(img, result.heatmap).save(os.path.join(args.overlay_dir, name))
+
+
+if __name__ == '__main__':
+    main()
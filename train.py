@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import logging
+import math
+import os
+import time
+
+from dataset import TRAIN_DIR, VALID_DIR, list_classes, list_labeled_images
+from inference_engine import configure_threads
+from preprocessing import IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Augmentation ranges from the notebook's ImageDataGenerator
+ROTATION_RANGE = 20
+SHIFT_RANGE = 0.2
+SHEAR_RANGE = 0.2
+ZOOM_RANGE = 0.2
+
+DEFAULT_WEIGHTS = '/kaggle/input/mobilenet-v2/mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_224_no_top.h5'
+
+
+def decode_and_resize(path, label, size=IMAGE_SIZE):
+    import tensorflow as tf
+    data = tf.io.read_file(path)
+    image = tf.io.decode_image(data, channels=3, expand_animations=False)
+    image = tf.image.resize(image, (size[1], size[0]))
+    # Keep decoded images as uint8 so the cache is four times smaller
+    return tf.cast(tf.round(image), tf.uint8), label
+
+
+# Apply the notebook's random rotation, shift, shear and zoom to a whole batch as
+# one projective transform per image, plus random horizontal flips
+def augment(images, labels):
+    import tensorflow as tf
+    n = tf.shape(images)[0]
+    height, width = float(images.shape[1]), float(images.shape[2])
+    theta = tf.random.uniform([n], -ROTATION_RANGE, ROTATION_RANGE) * math.pi / 180
+    shear = tf.random.uniform([n], -SHEAR_RANGE, SHEAR_RANGE) * math.pi / 180
+    zoom_x = tf.random.uniform([n], 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    zoom_y = tf.random.uniform([n], 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    shift_x = tf.random.uniform([n], -SHIFT_RANGE, SHIFT_RANGE) * width
+    shift_y = tf.random.uniform([n], -SHIFT_RANGE, SHIFT_RANGE) * height
+
+    # Map output pixels to input pixels: rotation @ shear @ zoom about the centre, then shift
+    a00 = tf.cos(theta) * zoom_x
+    a01 = -tf.sin(theta + shear) * zoom_y
+    a10 = tf.sin(theta) * zoom_x
+    a11 = tf.cos(theta + shear) * zoom_y
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    a02 = cx - a00 * cx - a01 * cy + shift_x
+    a12 = cy - a10 * cx - a11 * cy + shift_y
+    zeros = tf.zeros([n])
+    transforms = tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.shape(images)[1:3],
+        interpolation='BILINEAR', fill_mode='NEAREST', fill_value=0.0)
+    flip = tf.random.uniform([n, 1, 1, 1]) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    return images, labels
+
+
+def build_dataset(directory, num_classes, batch_size, training, cache=None, data_threads=None, seed=0):
+    import tensorflow as tf
+    samples = list_labeled_images(directory)
+    paths = [path for path, _ in samples]
+    labels = [label for _, label in samples]
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    # Keep decode order fixed so the cache and the seeded shuffle see the same sequence every run
+    dataset = dataset.map(decode_and_resize, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    if cache is not None:
+        # An empty string caches decoded images in memory, a path caches them on disk
+        if cache:
+            cache = cache_prefix(cache, samples)
+            clear_incomplete_cache(cache)
+        dataset = dataset.cache(cache)
+    if training:
+        dataset = dataset.shuffle(min(len(samples), 10000), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
+
+    def to_inputs(images, labels):
+        return tf.cast(images, tf.float32) / 255.0, tf.one_hot(labels, num_classes)
+
+    dataset = dataset.map(to_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+    if training:
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+
+    if data_threads:
+        options = tf.data.Options()
+        options.threading.private_threadpool_size = data_threads
+        dataset = dataset.with_options(options)
+    return dataset, len(samples)
+
+
+# Key an on-disk cache by the sample list and image size, so a different or grown
+# dataset gets a fresh cache instead of silently replaying the old images
+def cache_prefix(prefix, samples, size=IMAGE_SIZE):
+    digest = hashlib.sha1(f'{size[0]}x{size[1]}\n'.encode())
+    for path, label in samples:
+        digest.update(f'{path}\t{label}\n'.encode())
+    return f'{prefix}-{digest.hexdigest()[:12]}'
+
+
+# A run killed while writing the cache leaves a lockfile and partial data next
+# to a missing .index, which makes the resumed run fail; remove them so the
+# cache is rebuilt. Only call this before any dataset using the cache exists.
+def clear_incomplete_cache(prefix):
+    if os.path.exists(prefix + '.index'):
+        return
+    directory, name = os.path.split(prefix)
+    for filename in os.listdir(directory or '.'):
+        if filename.startswith(name) and ('.lockfile' in filename or '.data-' in filename):
+            logger.warning("Removing incomplete dataset cache file %s", filename)
+            os.remove(os.path.join(directory, filename))
+
+
+def build_model(num_classes, weights=DEFAULT_WEIGHTS, num_layers_to_freeze=100):
+    import tensorflow as tf
+    if weights and weights != 'imagenet' and not os.path.exists(weights):
+        logger.warning("MobileNetV2 weights %s not found, using imagenet weights", weights)
+        weights = 'imagenet'
+    base_model = tf.keras.applications.MobileNetV2(weights=weights, include_top=False,
+                                                   input_shape=IMAGE_SIZE[::-1] + (3,))
+    for layer in base_model.layers[:num_layers_to_freeze]:
+        layer.trainable = False
+    model = tf.keras.models.Sequential([
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def throughput_callback(batch_size, steps):
+    import tensorflow as tf
+
+    class Throughput(tf.keras.callbacks.Callback):
+        # Log training images/sec for every epoch
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            elapsed = time.perf_counter() - self.start
+            rate = steps * batch_size / elapsed
+            if logs is not None:
+                logs['images_per_sec'] = rate
+            logger.info("Epoch %d: %.1f images/sec (%.1fs)", epoch + 1, rate, elapsed)
+
+    return Throughput()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the plant disease model with a tf.data input pipeline.")
+    parser.add_argument('--train-dir', default=TRAIN_DIR)
+    parser.add_argument('--valid-dir', default=VALID_DIR)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--weights', default=DEFAULT_WEIGHTS, help="MobileNetV2 no-top weights file or 'imagenet'")
+    parser.add_argument('--cache-dir', default='.tf_cache', help="Where decoded, resized images are cached; '' caches in memory")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--packed-dir', help="Read pre-resized shards from shards.py (<dir>/<train/valid dir name>) instead of JPEGs")
+    parser.add_argument('--checkpoint-dir', default='checkpoints', help="Backups for resuming an interrupted run")
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    parser.add_argument('--data-threads', type=int, default=0, help="tf.data private thread pool size")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--deterministic', action='store_true',
+                        help="Make augmentation and kernels bit-for-bit reproducible for a seed (slower)")
+    parser.add_argument('--output', default='plant_disease_detection_model.h5')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    import tensorflow as tf
+    configure_threads(args.intra_op_threads, args.inter_op_threads)
+    tf.keras.utils.set_random_seed(args.seed)
+    if args.deterministic:
+        # Without this, parallel augmentation draws random numbers in varying order,
+        # so runs with the same seed are close but not identical
+        tf.config.experimental.enable_op_determinism()
+
+    train_cache = valid_cache = None
+    if not args.no_cache:
+        if args.cache_dir:
+            os.makedirs(args.cache_dir, exist_ok=True)
+            train_cache = os.path.join(args.cache_dir, 'train')
+            valid_cache = os.path.join(args.cache_dir, 'valid')
+        else:
+            train_cache = valid_cache = ''
+
+    if args.packed_dir:
+        # Packed shards are already decoded and resized, so there is nothing to cache
+        from shards import PackedDataset, packed_path
+        from inference import class_labels
+        num_classes = len(class_labels)
+        train_packed = PackedDataset(packed_path(args.packed_dir, args.train_dir))
+        valid_packed = PackedDataset(packed_path(args.packed_dir, args.valid_dir))
+        train_data, train_count = train_packed.to_tf_dataset(args.batch_size, True, args.seed), len(train_packed)
+        valid_data = valid_packed.to_tf_dataset(args.batch_size, False)
+    else:
+        num_classes = len(list_classes(args.train_dir))
+        train_data, train_count = build_dataset(args.train_dir, num_classes, args.batch_size, True,
+                                                train_cache, args.data_threads, args.seed)
+        valid_data, _ = build_dataset(args.valid_dir, num_classes, args.batch_size, False,
+                                      valid_cache, args.data_threads)
+    steps = math.ceil(train_count / args.batch_size)
+
+    model = build_model(num_classes, args.weights)
+    callbacks = [
+        tf.keras.callbacks.BackupAndRestore(args.checkpoint_dir),
+        tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', patience=3, factor=0.1, min_lr=1e-6),
+        throughput_callback(args.batch_size, steps),
+    ]
+    model.fit(train_data, epochs=args.epochs, validation_data=valid_data, callbacks=callbacks)
+    model.save(args.output)
+    print("Saved", args.output)
+
+
+if __name__ == '__main__':
+    main()
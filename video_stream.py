@@ -0,0 +1,327 @@
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from dataset import IMAGE_EXTENSIONS
+from inference import BATCH_SIZE, class_labels, predict_batch, prepare_image
+from preprocessing import IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+# Define the streaming defaults: the frame rate assumed for image-sequence
+# directories, the change needed before a frame is scored again (mean absolute
+# difference of a 32x32 grayscale signature, on a 0-255 scale) and the time
+# constant of the exponential smoothing of predictions
+SEQUENCE_FPS = float(os.environ.get('PLANT_SEQUENCE_FPS', '10'))
+FRAME_DIFF_THRESHOLD = float(os.environ.get('PLANT_FRAME_DIFF_THRESHOLD', '4.0'))
+SMOOTHING_SECONDS = float(os.environ.get('PLANT_SMOOTHING_SECONDS', '1.0'))
+SIGNATURE_FACTOR = IMAGE_SIZE[0] // 32
+
+# A timeline segment needs this smoothed confidence and duration to be reported
+TIMELINE_MIN_CONFIDENCE = 0.5
+MIN_SEGMENT_SECONDS = 0.5
+PROGRESS_SECONDS = 1.0
+
+# Frame statuses: scored by the model, a near-duplicate of the last scored
+# frame, rejected by the pre-filter, or dropped to keep up with playback
+SCORED, SKIPPED, REJECTED, DROPPED = 'scored', 'skipped', 'rejected', 'dropped'
+
+
+def video_supported():
+    return importlib.util.find_spec('cv2') is not None
+
+
+# Yield (index, seconds, uint8 frame at the model input size) from a video file
+def iter_video_frames(path, size=IMAGE_SIZE):
+    try:
+        import cv2
+    except ImportError:
+        raise RuntimeError("Reading video files needs OpenCV: pip install opencv-python-headless") from None
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise OSError(f"Cannot open video {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or SEQUENCE_FPS
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            with metrics.timed('decode'):
+                frame = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+            yield index, index / fps, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+# Yield frames from a directory of images in name order, at a fixed frame rate
+def iter_sequence_frames(directory, fps=SEQUENCE_FPS):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    for index, name in enumerate(names):
+        yield index, index / fps, prepare_image(os.path.join(directory, name))
+
+
+def iter_frames(source, fps=SEQUENCE_FPS):
+    if os.path.isdir(source):
+        return iter_sequence_frames(source, fps)
+    return iter_video_frames(source)
+
+
+class FrameSkipper:
+    # Flags frames that barely differ from the last frame that was scored.
+    # Comparing against the last scored frame, not the previous one, means a
+    # slow pan still triggers a new prediction once it has moved far enough.
+
+    def __init__(self, threshold=FRAME_DIFF_THRESHOLD):
+        self.threshold = threshold
+        self.last = None
+
+    def is_duplicate(self, pixels):
+        signature = np.asarray(Image.fromarray(pixels).convert('L').reduce(SIGNATURE_FACTOR), dtype=np.int16)
+        if self.last is not None and np.abs(signature - self.last).mean() < self.threshold:
+            return True
+        self.last = signature
+        return False
+
+
+class TemporalSmoother:
+    # Exponential moving average of prediction vectors, weighted by elapsed time
+    # so dropped and skipped frames do not change how fast it responds
+
+    def __init__(self, seconds=SMOOTHING_SECONDS):
+        self.seconds = seconds
+        self.state = None
+        self.time = None
+
+    def update(self, timestamp, probabilities):
+        if self.state is None or self.seconds <= 0:
+            self.state = np.array(probabilities, dtype=np.float64)
+        else:
+            weight = math.exp(-(timestamp - self.time) / self.seconds)
+            self.state = weight * self.state + (1 - weight) * probabilities
+        self.time = timestamp
+        return self.state
+
+
+class Timeline:
+    # Segments of constant smoothed verdict; None while nothing is confidently detected
+
+    def __init__(self, min_confidence=TIMELINE_MIN_CONFIDENCE, min_segment=MIN_SEGMENT_SECONDS):
+        self.min_confidence = min_confidence
+        self.min_segment = min_segment
+        self.segments = []
+
+    def add(self, timestamp, smoothed):
+        index = int(np.argmax(smoothed))
+        confidence = float(smoothed[index])
+        label = class_labels[index] if confidence >= self.min_confidence else None
+        if self.segments and self.segments[-1]['label'] == label:
+            segment = self.segments[-1]
+            segment['end'] = timestamp
+            segment['peak'] = max(segment['peak'], confidence)
+            segment['confidence_sum'] += confidence
+            segment['frames'] += 1
+        else:
+            if self.segments:
+                self.segments[-1]['end'] = timestamp
+            self.segments.append({'start': timestamp, 'end': timestamp, 'label': label, 'peak': confidence,
+                                  'confidence_sum': confidence, 'frames': 1})
+
+    def result(self):
+        # Fold segments shorter than min_segment into the one before them
+        merged = []
+        for segment in self.segments:
+            if merged and (segment['end'] - segment['start'] < self.min_segment or merged[-1]['label'] == segment['label']):
+                previous = merged[-1]
+                previous['end'] = segment['end']
+                previous['peak'] = max(previous['peak'], segment['peak'])
+                previous['confidence_sum'] += segment['confidence_sum']
+                previous['frames'] += segment['frames']
+                continue
+            merged.append(dict(segment))
+        return [{'start': s['start'], 'end': s['end'], 'label': s['label'] or "No detection",
+                 'confidence': s['confidence_sum'] / s['frames'], 'peak': s['peak']} for s in merged]
+
+
+class StreamStats:
+    # Frame counts by status, updated by the reader and scoring threads
+
+    def __init__(self):
+        self.counts = {SCORED: 0, SKIPPED: 0, REJECTED: 0, DROPPED: 0}
+        self.read = 0
+        self.video_seconds = 0.0
+        self.start = time.perf_counter()
+
+    def count(self, status, amount=1):
+        self.counts[status] += amount
+        metrics.registry.increment('plant_video_frames_total', amount, status=status)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def realtime_factor(self):
+        return self.video_seconds / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return {'frames': self.read, **self.counts, 'video_seconds': self.video_seconds,
+                'elapsed_seconds': self.elapsed, 'realtime_factor': self.realtime_factor}
+
+    def __str__(self):
+        return (f"t={self.video_seconds:.1f}s read {self.read}, scored {self.counts[SCORED]}, "
+                f"skipped {self.counts[SKIPPED]}, rejected {self.counts[REJECTED]}, "
+                f"dropped {self.counts[DROPPED]}, {self.realtime_factor:.2f}x realtime")
+
+
+def _read(frames, pending, stats, skipper, realtime, failure):
+    # Pace frames to their timestamps when emulating live playback; a frame that
+    # finds the queue full is dropped instead of delaying the stream
+    try:
+        start = time.perf_counter()
+        for index, timestamp, pixels in frames:
+            stats.read += 1
+            if realtime:
+                delay = timestamp - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                if pending.full():
+                    stats.count(DROPPED)
+                    continue
+            duplicate = skipper.is_duplicate(pixels)
+            pending.put((index, timestamp, None if duplicate else pixels))
+    except Exception as e:
+        failure.append(e)
+    finally:
+        pending.put(None)
+
+
+# Score a frame stream: near-duplicates reuse the last prediction, the rest are
+# batched through the model (after the optional pre-filter cascade), and the
+# smoothed predictions build a timeline of detected diseases
+def stream(frames, model, batch_size=BATCH_SIZE, realtime=False, diff_threshold=FRAME_DIFF_THRESHOLD,
+           smoothing_seconds=SMOOTHING_SECONDS, cascade=None, on_progress=None):
+    stats = StreamStats()
+    pending = queue.Queue(maxsize=batch_size * 2)
+    failure = []
+    reader = threading.Thread(target=_read, args=(frames, pending, stats, FrameSkipper(diff_threshold), realtime,
+                                                  failure), daemon=True)
+    reader.start()
+
+    smoother = TemporalSmoother(smoothing_seconds)
+    timeline = Timeline()
+    frame_log = []
+    last = np.zeros(len(class_labels), dtype=np.float32)
+    last_progress = 0.0
+    done = False
+    while not done:
+        item = pending.get()
+        if item is None:
+            break
+        # Take whatever else is already waiting, up to one batch
+        batch = [item]
+        while len(batch) < batch_size:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+
+        new = [i for i, (_, _, pixels) in enumerate(batch) if pixels is not None]
+        accepted = new
+        if cascade is not None and new:
+            decisions = cascade.check_batch([batch[i][2] for i in new])
+            accepted = [i for i, decision in zip(new, decisions) if decision.accepted]
+        predictions = {}
+        if accepted:
+            scored = predict_batch(model, [batch[i][2] for i in accepted], 1 if len(accepted) == 1 else batch_size)
+            predictions = dict(zip(accepted, scored))
+
+        for i, (index, timestamp, pixels) in enumerate(batch):
+            if pixels is None:
+                status = SKIPPED
+            elif i in predictions:
+                status = SCORED
+                last = predictions[i]
+            else:
+                # No leaf in view: let the smoothed verdict decay
+                status = REJECTED
+                last = np.zeros(len(class_labels), dtype=np.float32)
+            stats.count(status)
+            smoothed = smoother.update(timestamp, last)
+            timeline.add(timestamp, smoothed)
+            top = int(np.argmax(smoothed))
+            frame_log.append({'index': index, 'time': timestamp, 'status': status,
+                              'label': class_labels[top], 'confidence': float(smoothed[top])})
+            stats.video_seconds = timestamp
+
+        if stats.elapsed - last_progress >= PROGRESS_SECONDS:
+            last_progress = stats.elapsed
+            logger.info("%s", stats)
+            if on_progress is not None:
+                on_progress(stats)
+
+    reader.join()
+    if failure:
+        raise failure[0]
+    logger.info("Finished: %s", stats)
+    return {'segments': timeline.result(), 'stats': stats.summary(), 'frames': frame_log}
+
+
+def print_timeline(result):
+    for segment in result['segments']:
+        print(f"{segment['start']:>8.1f}s - {segment['end']:>8.1f}s  {segment['label']:<32}"
+              f"{segment['confidence'] * 100:>6.1f}% (peak {segment['peak'] * 100:.1f}%)")
+    stats = result['stats']
+    print(f"{stats['frames']} frames: {stats['scored']} scored, {stats['skipped']} skipped as near-duplicates, "
+          f"{stats['rejected']} rejected, {stats['dropped']} dropped; "
+          f"{stats['video_seconds']:.1f}s of video in {stats['elapsed_seconds']:.1f}s "
+          f"({stats['realtime_factor']:.2f}x realtime)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a disease timeline from a video file or image-sequence directory.")
+    parser.add_argument('source', help="Video file or directory of frames")
+    parser.add_argument('--fps', type=float, default=SEQUENCE_FPS, help="Frame rate of an image-sequence directory")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--diff-threshold', type=float, default=FRAME_DIFF_THRESHOLD,
+                        help="Mean grayscale change (0-255) before a frame is scored again; 0 scores every frame")
+    parser.add_argument('--smoothing', type=float, default=SMOOTHING_SECONDS, help="Smoothing time constant in seconds")
+    parser.add_argument('--realtime', action='store_true', help="Pace frames like live playback and drop what cannot keep up")
+    parser.add_argument('--prefilter', action='store_true', help="Skip frames without a supported leaf")
+    parser.add_argument('-o', '--output', help="Write the timeline, statistics and per-frame results as JSON")
+    args = parser.parse_args(argv)
+
+    import model_registry
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    model = model_registry.get_model()
+    cascade = None
+    if args.prefilter:
+        import prefilter
+        cascade = prefilter.load_cascade()
+    result = stream(iter_frames(args.source, args.fps), model, args.batch_size, args.realtime,
+                    args.diff_threshold, args.smoothing, cascade)
+    print_timeline(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()